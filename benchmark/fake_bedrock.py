@@ -0,0 +1,65 @@
+import random
+import re
+import threading
+import time
+
+from pipeline.jsonl import read_records
+
+# The question follows the "-- Using valid <dialect> ..." line of generate_comment_prompt
+QUESTION_PATTERN = re.compile(r"^-- Using valid [^\n]*\n-- (.*)$", re.MULTILINE)
+
+
+class ThrottlingException(Exception):
+    """
+    Raised by the fake model to simulate throttling; carries the same error
+    code as a botocore ClientError so the rate limiter treats it alike.
+    """
+
+    response = {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded (simulated)"}}
+
+
+def load_canned_answers(answers_file: str) -> dict:
+    """
+    Returns question -> generated SQL from a raw LLM output file, keeping the
+    last attempt of every question.
+    """
+    return {record["question"]: record["text_2_sql"] for record in read_records(answers_file)}
+
+
+def question_from_prompt(prompt: str):
+    match = QUESTION_PATTERN.search(prompt)
+    return match.group(1) if match else None
+
+
+class CannedResponder:
+    """
+    Responder for FakeAdapter answering every prompt with the SQL previously
+    generated for its question, after a simulated latency.
+
+    latency is the mean response time in seconds, spread uniformly by +/- jitter
+    (a fraction); throttle_rate is the probability of raising ThrottlingException.
+    Unknown questions are answered with default_sql. Random draws come from a
+    seeded generator, so a run is reproducible for a given seed and call order.
+    """
+
+    def __init__(self, answers: dict, latency: float = 0.0, jitter: float = 0.0, throttle_rate: float = 0.0,
+                 seed: int = 0, default_sql: str = "SELECT 1;"):
+        self.answers = answers
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.default_sql = default_sql
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt: str) -> str:
+        with self._lock:
+            throttled = self._random.random() < self.throttle_rate
+            delay = self.latency * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+
+        if throttled:
+            # Throttles are answered quickly, as Bedrock does
+            time.sleep(delay / 10)
+            raise ThrottlingException("Rate exceeded (simulated)")
+        time.sleep(delay)
+        return self.answers.get(question_from_prompt(prompt), self.default_sql)
@@ -0,0 +1,122 @@
+import random
+import re
+from datetime import date, datetime, timedelta
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from llm.schema import TABLES_FILE, load_tables_metadata
+from pgdb.pg_utils import PG_CONFIG
+
+# BIRD tables JSON column types -> PostgreSQL types
+COLUMN_TYPES = {
+    "integer": "BIGINT",
+    "real": "REAL",
+    "text": "TEXT",
+    "date": "DATE",
+    "datetime": "TIMESTAMP",
+}
+
+SIMPLE_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+BASE_DATE = date(2010, 1, 1)
+
+
+def column_identifier(name: str) -> str:
+    """
+    Column name as stored in the BIRD database: plain names are folded to lowercase,
+    names with spaces or punctuation keep their original case (and need quoting).
+    """
+    return name.lower() if SIMPLE_IDENTIFIER.match(name) else name
+
+
+def synthetic_value(column_type: str, rng: random.Random, rows: int):
+    """
+    Random value of the given type. Integers and texts are drawn from 1..rows,
+    so joins on key columns match about one row each.
+    """
+    match column_type:
+        case "integer":
+            return rng.randint(1, rows)
+        case "real":
+            return round(rng.uniform(0, 1000), 2)
+        case "date":
+            return BASE_DATE + timedelta(days=rng.randint(0, 3650))
+        case "datetime":
+            return datetime.combine(BASE_DATE, datetime.min.time()) + timedelta(seconds=rng.randint(0, 315360000))
+        case _:
+            return str(rng.randint(1, rows))
+
+
+def ensure_database(dbname: str):
+    """
+    Creates dbname on the PG_CONFIG server if it does not exist.
+    """
+    db = psycopg2.connect(**{**PG_CONFIG, "dbname": "postgres"})
+    try:
+        db.autocommit = True
+        cursor = db.cursor()
+        cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (dbname,))
+        if cursor.fetchone() is None:
+            cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(dbname)))
+    finally:
+        db.close()
+
+
+def seed_database(db_ids, dbname: str, rows: int = 200, seed: int = 0, tables_file: str = TABLES_FILE):
+    """
+    (Re)creates one schema per db_id in dbname, with the tables and columns of
+    tables_file, filled with rows deterministic synthetic rows per table.
+    Keys and constraints are left out: the data only has to make the queries run.
+
+    Tables keep their original (quoted) casing, as listed in db_table_map and looked
+    up by the schema provider. BIRD SQL names them unquoted, which PostgreSQL folds
+    to lowercase, so a mixed-case table also gets a lowercase view over it.
+    """
+    ensure_database(dbname)
+    metadata = load_tables_metadata(tables_file)
+
+    db = psycopg2.connect(**{**PG_CONFIG, "dbname": dbname})
+    try:
+        cursor = db.cursor()
+        for db_id in sorted(set(db_ids)):
+            entry = metadata[db_id]
+            schema = sql.Identifier(db_id)
+            cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(schema))
+            cursor.execute(sql.SQL("CREATE SCHEMA {}").format(schema))
+
+            for table_idx, table_name in enumerate(entry["table_names_original"]):
+                columns = [
+                    (column_identifier(column), column_type)
+                    for (column_table_idx, column), column_type
+                    in zip(entry["column_names_original"], entry["column_types"])
+                    if column_table_idx == table_idx
+                ]
+                table = sql.Identifier(db_id, table_name)
+                cursor.execute(sql.SQL("CREATE TABLE {} ({})").format(
+                    table,
+                    sql.SQL(", ").join(
+                        sql.SQL("{} {}").format(sql.Identifier(name), sql.SQL(COLUMN_TYPES.get(column_type, "TEXT")))
+                        for name, column_type in columns
+                    ),
+                ))
+
+                rng = random.Random(f"{seed}:{db_id}:{table_name}")
+                values = [
+                    tuple(synthetic_value(column_type, rng, rows) for _, column_type in columns)
+                    for _ in range(rows)
+                ]
+                execute_values(
+                    cursor,
+                    sql.SQL("INSERT INTO {} VALUES %s").format(table).as_string(cursor),
+                    values,
+                )
+                if table_name != table_name.lower():
+                    cursor.execute(sql.SQL("CREATE VIEW {} AS SELECT * FROM {}").format(
+                        sql.Identifier(db_id, table_name.lower()), table,
+                    ))
+            print(f"[BENCH] Seeded {db_id}: {len(entry['table_names_original'])} tables x {rows} rows")
+        cursor.execute("ANALYZE")
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+import argparse
+import itertools
+import json
+import os
+import time
+import tracemalloc
+
+from benchmark.fake_bedrock import CannedResponder, load_canned_answers
+from benchmark.fixtures import seed_database
+from evaluation.run_evaluation import evaluate_llm_outputs
+from llm.adapters import FakeAdapter, register_adapter
+from llm.clean_output import clean_llm_output
+from llm.llm_request import set_completion_cache
+from llm.rate_limit import RateLimiter, set_rate_limiter
+from llm.run_llm_exp import run_llm_process
+from llm.schema import create_schema_provider, set_schema_provider
+from pgdb.pg_utils import configure_pool, close_pool
+from pipeline.jsonl import read_records, write_records
+from pipeline.metrics import METRICS
+
+# Model id served by the fake adapter registered for the benchmark
+BENCHMARK_MODEL_ID = "fake.benchmark"
+
+
+def count_records(path: str) -> int:
+    return sum(1 for _ in read_records(path))
+
+
+def run_stage(name: str, fn, output_file: str) -> dict:
+    """
+    Runs fn() and returns its wall time, throughput, peak traced memory and the
+    timers and counters recorded while it ran.
+    """
+    METRICS.reset()
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    items = count_records(output_file)
+    report = METRICS.report()
+    print(f"[BENCH] {name}: {items} records in {seconds:.2f}s, peak memory {peak / 2 ** 20:.1f} MiB")
+    return {
+        "records": items,
+        "seconds": round(seconds, 3),
+        "records_per_second": round(items / seconds, 3) if seconds else None,
+        "peak_memory_mib": round(peak / 2 ** 20, 3),
+        **report,
+    }
+
+
+def run_benchmark(input_file: str, work_dir: str, max_workers: int, responder, backoff_base: float) -> dict:
+    """
+    Runs the generation, cleaning and evaluation stages on input_file with the
+    fake model and returns the measurements of every stage.
+    """
+    raw_output_file = os.path.join(work_dir, f"raw_{max_workers}.jsonl")
+    cleaned_output_file = os.path.join(work_dir, f"cleaned_{max_workers}.jsonl")
+    output_log_path = os.path.join(work_dir, f"log_{max_workers}.jsonl")
+
+    # Fresh limiter per run, allowed to use all the workers from the start
+    limiter = RateLimiter(max_concurrency=max_workers, initial_concurrency=max_workers, backoff_base=backoff_base)
+    set_rate_limiter(BENCHMARK_MODEL_ID, limiter)
+    register_adapter(BENCHMARK_MODEL_ID, FakeAdapter(responder))
+    # Fresh schema provider too, so every run pays for its own catalog queries
+    set_schema_provider(create_schema_provider("postgres"))
+
+    stages = {
+        "llm": run_stage("llm", lambda: run_llm_process(
+            input_file, raw_output_file, BENCHMARK_MODEL_ID, max_workers=max_workers,
+        ), raw_output_file),
+        "clean": run_stage("clean", lambda: clean_llm_output(
+            raw_output_file, cleaned_output_file, model_id=BENCHMARK_MODEL_ID,
+        ), cleaned_output_file),
+        "evaluation": run_stage("evaluation", lambda: evaluate_llm_outputs(
+            cleaned_output_file, output_log_path, max_workers=max_workers,
+        ), output_log_path),
+    }
+    return {"max_workers": max_workers, "stages": stages, "rate_limiter": limiter.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline against a fake Bedrock model and a seeded PostgreSQL database."
+    )
+    parser.add_argument("--input_file", type=str, default="data/dev_enriched.json", help="Path to the questions.")
+    parser.add_argument("--answers_file", type=str, default="results/dev_enriched_raw.json",
+                        help="Raw LLM output whose SQL is replayed by the fake model.")
+    parser.add_argument("--questions", type=int, default=100, help="Number of questions to run (0 for all).")
+    parser.add_argument("--max_workers", type=int, nargs="+", default=[1, 8],
+                        help="Concurrency settings to compare; the pipeline runs once per value.")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean fake model latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.3, help="Latency spread as a fraction of the mean.")
+    parser.add_argument("--throttle_rate", type=float, default=0.0, help="Probability of a simulated throttle.")
+    parser.add_argument("--backoff_base", type=float, default=0.1, help="Base retry backoff in seconds.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the fake model and of the database rows.")
+    parser.add_argument("--dbname", type=str, default="BIRD_benchmark", help="Database seeded for the benchmark.")
+    parser.add_argument("--rows", type=int, default=200, help="Synthetic rows per table.")
+    parser.add_argument("--skip_seed", action="store_true", help="Reuse the already seeded database.")
+    parser.add_argument("--work_dir", type=str, default="results/benchmark", help="Directory for stage outputs.")
+    parser.add_argument("--output_file", type=str, default="results/benchmark/report.json",
+                        help="Path to save the benchmark report.")
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    input_file = os.path.join(args.work_dir, "questions.jsonl")
+    questions = read_records(args.input_file)
+    if args.questions:
+        questions = itertools.islice(questions, args.questions)
+    write_records(input_file, questions)
+    db_ids = {question["db_id"] for question in read_records(input_file)}
+
+    if not args.skip_seed:
+        seed_database(db_ids, args.dbname, rows=args.rows, seed=args.seed)
+    configure_pool(maxconn=max(args.max_workers) + 2, dbname=args.dbname)
+    set_completion_cache(None)
+
+    answers = load_canned_answers(args.answers_file)
+    runs = []
+    for max_workers in args.max_workers:
+        print(f"[BENCH] Running with max_workers={max_workers}...")
+        responder = CannedResponder(answers, latency=args.latency, jitter=args.jitter,
+                                    throttle_rate=args.throttle_rate, seed=args.seed)
+        runs.append(run_benchmark(input_file, args.work_dir, max_workers, responder, args.backoff_base))
+    close_pool()
+
+    report = {"parameters": vars(args), "runs": runs}
+    with open(args.output_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    for run in runs:
+        summary = ", ".join(f"{name} {stage['records_per_second']}/s" for name, stage in run["stages"].items())
+        print(f"[BENCH] max_workers={run['max_workers']}: {summary}")
+    print(f"[BENCH] Report saved to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
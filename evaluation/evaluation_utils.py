@@ -1,3 +1,4 @@
+from collections import Counter
 from typing import Tuple, Set, List
 
 
@@ -24,3 +25,25 @@ def precision_recall_f1(
         if (precision + recall) else 0.0
     )
     return precision, recall, f1
+
+
+def multiset_precision_recall_f1(
+        ground_truth: Counter, predicted: Counter
+) -> Tuple[float, float, float]:
+    """
+    Precision, recall, and F1-score over multisets (element -> count),
+    where duplicated elements are matched at most as many times as they
+    appear on both sides:
+      TP = sum(min(ground_truth[x], predicted[x]))
+    """
+    tp = sum((ground_truth & predicted).values())
+    pred_total = sum(predicted.values())
+    gt_total = sum(ground_truth.values())
+
+    precision = tp / pred_total if pred_total else 0.0
+    recall = tp / gt_total if gt_total else 0.0
+    f1 = (
+        2 * precision * recall / (precision + recall)
+        if (precision + recall) else 0.0
+    )
+    return precision, recall, f1
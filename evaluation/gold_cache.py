@@ -0,0 +1,115 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import zlib
+
+from pgdb.pg_utils import database_fingerprint, execute_query_and_get_rows
+from pgdb.sql_parse import normalize_sql
+
+
+class GoldResultCache:
+    """
+    Persistent store of ground-truth query results, kept in a SQLite file.
+
+    Results are keyed by (db_id, normalized SQL, database fingerprint, kind of
+    result, e.g. a row set or a fingerprint multiset) and stored
+    as zlib-compressed pickles, so a gold query is executed once per dataset
+    version instead of once per evaluated record. The file is opened lazily on
+    first use, and the database fingerprint is computed once per db_id (see
+    database_fingerprint for what it covers).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+        self._fingerprint_lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS gold_results (
+                    key TEXT PRIMARY KEY,
+                    db_id TEXT NOT NULL,
+                    sql TEXT NOT NULL,
+                    rows BLOB NOT NULL
+                )
+                """
+            )
+            self._db.commit()
+        return self._db
+
+    def _key(self, db_id: str, sql: str, fingerprint: str, kind: str) -> str:
+        raw = "\x1f".join([db_id, normalize_sql(sql), fingerprint, kind])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _fingerprint(self, db_id: str, cursor) -> str:
+        # Computed by the first thread asking for db_id; the others wait for it
+        with self._fingerprint_lock:
+            fingerprint = self._fingerprints.get(db_id)
+            if fingerprint is None:
+                fingerprint = database_fingerprint(cursor, db_id)
+                self._fingerprints[db_id] = fingerprint
+        return fingerprint
+
+    def get(self, db_id: str, sql: str, fingerprint: str, kind: str = "rows"):
+        key = self._key(db_id, sql, fingerprint, kind)
+        with self._lock:
+            row = self._connect().execute("SELECT rows FROM gold_results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def put(self, db_id: str, sql: str, fingerprint: str, rows, kind: str = "rows"):
+        key = self._key(db_id, sql, fingerprint, kind)
+        blob = zlib.compress(pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO gold_results (key, db_id, sql, rows) VALUES (?, ?, ?, ?)",
+                (key, db_id, normalize_sql(sql), blob)
+            )
+            db.commit()
+
+    def get_or_compute(self, db_id: str, sql: str, cursor, compute, kind: str = "rows"):
+        """
+        Returns the stored result of the gold query, calling compute() only on a cache miss.
+        Empty results are not stored, since they may come from a failed or timed out query.
+        """
+        fingerprint = self._fingerprint(db_id, cursor)
+        result = self.get(db_id, sql, fingerprint, kind)
+        if result is None:
+            result = compute()
+            if result:
+                self.put(db_id, sql, fingerprint, result, kind)
+        return result
+
+    def get_rows(self, db_id: str, sql: str, cursor, statement_timeout_ms: int = None):
+        """
+        Returns the row set of the gold query, executing it on cursor only on a cache miss.
+        """
+        return self.get_or_compute(
+            db_id, sql, cursor,
+            lambda: execute_query_and_get_rows(sql, cursor, statement_timeout_ms)
+        )
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -1,48 +1,130 @@
 import decimal
 import json
+import os
+from collections import Counter
 from datetime import date, datetime, timedelta
 from decimal import Decimal
 
-from evaluation.evaluation_utils import precision_recall_f1
-from pgdb.pg_utils import execute_query_and_get_rows, connect_postgresql
+from evaluation.evaluation_utils import precision_recall_f1, multiset_precision_recall_f1
+from evaluation.gold_cache import GoldResultCache
+from pgdb.pg_utils import execute_query_and_get_rows, get_connection, stream_query_fingerprints
+from pgdb.sql_parse import extract_tables
+from pipeline.concurrency import ordered_map
+from pipeline.jsonl import read_records, write_records
+from pipeline.metrics import increment, timed, timer
 import psycopg2
-from sql_metadata import Parser
 
+# Per-query timeout, so a single runaway predicted query cannot stall the evaluation
+EVAL_STATEMENT_TIMEOUT_MS = int(os.getenv("EVAL_STATEMENT_TIMEOUT_MS", "60000"))
 
-def evaluate_item(item):
+# Row-level comparison mode: "set" materializes both results as sets of tuples,
+# "stream" compares multisets of row fingerprints read through a server-side cursor
+EVAL_ROW_COMPARISON = os.getenv("EVAL_ROW_COMPARISON", "set")
+EVAL_SAMPLE_ROWS = int(os.getenv("EVAL_SAMPLE_ROWS", "5"))
+EVAL_MAX_ROWS = int(os.getenv("EVAL_MAX_ROWS", "1000000"))
+
+
+@timed("evaluate_item", label=lambda item, *args, **kwargs: item["db_id"])
+def evaluate_item(item, statement_timeout_ms: int = EVAL_STATEMENT_TIMEOUT_MS, gold_cache: GoldResultCache = None,
+                  row_comparison: str = EVAL_ROW_COMPARISON):
     """Evaluate a single item using table and row-level metrics."""
     db_id = item["db_id"]
-    db = connect_postgresql()
-    cursor = db.cursor()
-    valid_query = True
 
     try:
-        # Set schema to match DB ID (schema name)
-        cursor.execute(f"SET search_path TO {db_id}, public;")
+        # Pooled connection with the search_path set to the DB ID (schema name)
+        with get_connection(db_id) as db:
+            return compare_item(item, db.cursor(), statement_timeout_ms, gold_cache, row_comparison)
     except psycopg2.Error as e:
-        print(f"Error setting schema for {db_id}: {e}")
+        print(f"Database error while evaluating {db_id}: {e}")
         return None
 
+
+def compare_rows(db_id, true_sql, predicted_sql, cursor, statement_timeout_ms=None, gold_cache=None):
+    """Row-level comparison on materialized sets of tuples."""
+    if gold_cache is not None:
+        rowset_gt = gold_cache.get_rows(db_id, true_sql, cursor, statement_timeout_ms)
+    else:
+        rowset_gt = execute_query_and_get_rows(true_sql, cursor, statement_timeout_ms)
+    rowset_pred = execute_query_and_get_rows(predicted_sql, cursor, statement_timeout_ms)
+
+    p_row, r_row, f_row = precision_recall_f1(rowset_gt, rowset_pred)
+
+    return bool(rowset_pred), {
+        "groundtruth": list(rowset_gt),
+        "predicted": list(rowset_pred),
+        "precision": p_row,
+        "recall": r_row,
+        "f1": f_row
+    }
+
+
+def compare_rows_streaming(db_id, true_sql, predicted_sql, cursor, statement_timeout_ms=None, gold_cache=None):
+    """
+    Row-level comparison on multisets of row fingerprints.
+    Only the row counts and a bounded sample of each result are kept for the log.
+    """
+    db = cursor.connection
+
+    def stream(sql):
+        return stream_query_fingerprints(sql, db, statement_timeout_ms,
+                                         sample_size=EVAL_SAMPLE_ROWS, max_rows=EVAL_MAX_ROWS)
+
+    if gold_cache is not None:
+        result_gt = gold_cache.get_or_compute(db_id, true_sql, cursor, lambda: stream(true_sql),
+                                              kind=f"stream:{EVAL_SAMPLE_ROWS}:{EVAL_MAX_ROWS}")
+    else:
+        result_gt = stream(true_sql)
+    result_pred = stream(predicted_sql)
+
+    empty = {"fingerprints": Counter(), "count": 0, "sample": [], "truncated": False}
+    result_gt = result_gt or empty
+    result_pred = result_pred or empty
+
+    p_row, r_row, f_row = multiset_precision_recall_f1(result_gt["fingerprints"], result_pred["fingerprints"])
+
+    return result_pred["count"] > 0, {
+        "groundtruth_count": result_gt["count"],
+        "predicted_count": result_pred["count"],
+        "groundtruth_sample": result_gt["sample"],
+        "predicted_sample": result_pred["sample"],
+        "truncated": result_gt["truncated"] or result_pred["truncated"],
+        "precision": p_row,
+        "recall": r_row,
+        "f1": f_row
+    }
+
+
+def extract_tables_or_empty(sql: str) -> list:
+    """
+    Returns the tables referenced by sql, or an empty list if it cannot be parsed,
+    so an unparseable query is scored as using no table instead of aborting the evaluation.
+    """
+    try:
+        return extract_tables(sql)
+    except Exception as err:
+        increment("extract_tables.errors")
+        print(f"Could not extract the tables of {sql}: {err}")
+        return []
+
+
+def compare_item(item, cursor, statement_timeout_ms: int = None, gold_cache: GoldResultCache = None,
+                 row_comparison: str = "set"):
+    """Compare the ground truth and predicted SQL of an item on the given cursor."""
+    db_id = item["db_id"]
+
     true_sql = item["true_sql"]
     predicted_sql = item["text_2_sql"]
 
     # ---- Table-level evaluation ----
-    gt_tables = Parser(true_sql).tables
-    pred_tables = Parser(predicted_sql).tables
+    with timer("extract_tables"):
+        gt_tables = extract_tables_or_empty(true_sql)
+        pred_tables = extract_tables_or_empty(predicted_sql)
     p_tab, r_tab, f_tab = precision_recall_f1(gt_tables, pred_tables)
 
     # ---- Row-level evaluation (by executing queries) ----
+    compare = compare_rows_streaming if row_comparison == "stream" else compare_rows
+    valid_query, rows = compare(db_id, true_sql, predicted_sql, cursor, statement_timeout_ms, gold_cache)
 
-    rowset_gt = execute_query_and_get_rows(true_sql, cursor)
-    rowset_pred = execute_query_and_get_rows(predicted_sql, cursor)
-
-    if not rowset_pred:
-        valid_query = False
-
-
-    p_row, r_row, f_row = precision_recall_f1(rowset_gt, rowset_pred)
-
-    # close connection
     cursor.close()
 
     # Return the evaluation results
@@ -59,13 +141,7 @@ def evaluate_item(item):
             "recall": r_tab,
             "f1": f_tab
         },
-        "rows": {
-            "groundtruth": list(rowset_gt),
-            "predicted": list(rowset_pred),
-            "precision": p_row,
-            "recall": r_row,
-            "f1": f_row
-        }
+        "rows": rows
     }
 
 def avg(lst):
@@ -83,63 +159,91 @@ class DecimalEncoder(json.JSONEncoder):
             return str(o)
         return super(DecimalEncoder, self).default(o)
 
-def evaluate_llm_outputs(json_path: str, output_log_path: str):
+def evaluate_records(records, output_log_path: str, max_workers: int = 1,
+                     statement_timeout_ms: int = EVAL_STATEMENT_TIMEOUT_MS, gold_cache_path: str = None,
+                     row_comparison: str = EVAL_ROW_COMPARISON):
     """
     Main evaluation routine:
-    - Loads the input JSON
+    - Consumes the cleaned records from any iterable (e.g. a file stream or the
+      output of the previous stage), one at a time
     - Connects to PostgreSQL
-    - Evaluates table and row-level metrics
-    - Logs and prints results
+    - Evaluates table and row-level metrics, with up to max_workers items
+      evaluated in parallel on pooled connections
+    - Reuses ground-truth results stored in gold_cache_path, if given
+    - Compares rows as sets of tuples (row_comparison="set") or as streamed
+      multisets of row fingerprints with bounded memory (row_comparison="stream")
+    - Logs and prints results, in input order
     """
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    counts = {"total": 0, "valid": 0}
 
-    # Flatten if wrapped in an extra list
-    if isinstance(data, list) and len(data) == 1 and isinstance(data[0], list):
-        data = data[0]
+    def valid_items():
+        # dropping all not valid queries
+        for item in records:
+            counts["total"] += 1
+            if item["is_valid"]:
+                counts["valid"] += 1
+                yield item
 
-    table_precision_list = []
-    table_recall_list = []
-    table_f1_list = []
+    gold_cache = GoldResultCache(gold_cache_path) if gold_cache_path else None
 
-    row_precision_list = []
-    row_recall_list = []
-    row_f1_list = []
+    results = ordered_map(
+        lambda item: evaluate_item(item, statement_timeout_ms, gold_cache, row_comparison),
+        valid_items(),
+        max_workers=max_workers,
+    )
 
-    evaluation_log = []
+    # Running sums, so memory does not grow with the number of evaluated items
+    metrics = ["table_precision", "table_recall", "table_f1", "row_precision", "row_recall", "row_f1"]
+    totals = dict.fromkeys(metrics, 0.0)
+    evaluated = 0
 
-    # dropping all not valid queries
-    original_len = len(data)
-    data = [item for item in data if item["is_valid"]]
-    print(f"Evaluating {json_path} of length {original_len}...")
-    print(f"Number of valid queries: {len(data)}")
-    print(f"Number of invalid queries: {original_len - len(data)}")
+    def logged_results():
+        nonlocal evaluated
+        for result in results:
+            if result is None:
+                continue
 
-    for item in data:
+            evaluated += 1
+            totals["table_precision"] += result["tables"]["precision"]
+            totals["table_recall"] += result["tables"]["recall"]
+            totals["table_f1"] += result["tables"]["f1"]
 
-        result = evaluate_item(item)
-        if result is None:
-            continue
+            totals["row_precision"] += result["rows"]["precision"]
+            totals["row_recall"] += result["rows"]["recall"]
+            totals["row_f1"] += result["rows"]["f1"]
 
-        evaluation_log.append(result)
+            yield result
 
-        table_precision_list.append(result["tables"]["precision"])
-        table_recall_list.append(result["tables"]["recall"])
-        table_f1_list.append(result["tables"]["f1"])
+    # Results are streamed to the log (JSONL or legacy JSON array) as they are produced
+    write_records(output_log_path, logged_results(), default=DecimalEncoder().default)
 
-        row_precision_list.append(result["rows"]["precision"])
-        row_recall_list.append(result["rows"]["recall"])
-        row_f1_list.append(result["rows"]["f1"])
+    def mean(metric):
+        return totals[metric] / evaluated if evaluated else 0.0
+
+    print(f"Number of valid queries: {counts['valid']}")
+    print(f"Number of invalid queries: {counts['total'] - counts['valid']}")
 
     print("=== Table Usage Evaluation ===")
-    print(f"Precision: {avg(table_precision_list):.4f}")
-    print(f"Recall:    {avg(table_recall_list):.4f}")
-    print(f"F1:        {avg(table_f1_list):.4f}\n")
+    print(f"Precision: {mean('table_precision'):.4f}")
+    print(f"Recall:    {mean('table_recall'):.4f}")
+    print(f"F1:        {mean('table_f1'):.4f}\n")
 
     print("=== Row-Level Evaluation ===")
-    print(f"Precision: {avg(row_precision_list):.4f}")
-    print(f"Recall:    {avg(row_recall_list):.4f}")
-    print(f"F1:        {avg(row_f1_list):.4f}")
+    print(f"Precision: {mean('row_precision'):.4f}")
+    print(f"Recall:    {mean('row_recall'):.4f}")
+    print(f"F1:        {mean('row_f1'):.4f}")
+
+    if gold_cache is not None:
+        print(f"Gold result cache: {gold_cache.stats()}")
+        gold_cache.close()
 
-    with open(output_log_path, "w", encoding="utf-8") as fout:
-        json.dump(evaluation_log, fout, ensure_ascii=False, indent=2, cls=DecimalEncoder)
\ No newline at end of file
+
+def evaluate_llm_outputs(json_path: str, output_log_path: str, max_workers: int = 1,
+                         statement_timeout_ms: int = EVAL_STATEMENT_TIMEOUT_MS, gold_cache_path: str = None,
+                         row_comparison: str = EVAL_ROW_COMPARISON):
+    """
+    Evaluates the records of json_path (JSONL or legacy JSON array), see evaluate_records.
+    """
+    print(f"Evaluating {json_path}...")
+    evaluate_records(read_records(json_path), output_log_path, max_workers, statement_timeout_ms,
+                     gold_cache_path, row_comparison)
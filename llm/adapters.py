@@ -0,0 +1,272 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+
+# Cross-region inference profile ids prefix the model id with a geography, e.g. "us.anthropic.claude-..."
+INFERENCE_PROFILE_PREFIXES = ("us.", "eu.", "apac.")
+
+
+class ModelAdapter(ABC):
+    """
+    Model family specific handling of Bedrock requests: building the request body
+    from input_data (a dict with a 'prompt' and optional sampling parameters),
+    extracting the generated text and the token counts from the response, and
+    decoding response stream chunks.
+    """
+
+    # True for adapters answering locally instead of calling Bedrock (see LocalModelAdapter)
+    is_local = False
+    supports_streaming = True
+
+    @abstractmethod
+    def build_payload(self, input_data: dict) -> dict:
+        """
+        Returns the request body for input_data.
+        """
+
+    @abstractmethod
+    def parse_response(self, result: dict) -> str:
+        """
+        Returns the generated text of a decoded response body.
+        """
+
+    def token_usage(self, result: dict) -> tuple:
+        """
+        Returns the (input_tokens, output_tokens) reported in a response body, or (0, 0).
+        """
+        return 0, 0
+
+    @abstractmethod
+    def parse_stream_chunk(self, chunk: dict) -> str:
+        """
+        Returns the text delta carried by a decoded response stream chunk ("" if none).
+        """
+
+    def stream_token_usage(self, chunk: dict) -> tuple:
+        """
+        Returns the (input_tokens, output_tokens) carried by a stream chunk, or None.
+        Bedrock adds the invocation metrics to the last chunk of every stream.
+        """
+        metrics = chunk.get("amazon-bedrock-invocationMetrics")
+        if metrics is None:
+            return None
+        return metrics.get("inputTokenCount", 0), metrics.get("outputTokenCount", 0)
+
+
+class TitanAdapter(ModelAdapter):
+    ### The Titan text model typically expects a JSON body with this structure:
+    # {
+    #   "inputText": "<your prompt>"
+    #   "textGenerationConfig": {
+    #       "maxTokenCount": <int>,
+    #       "temperature": <float>,
+    #       "topP": <float>,
+    #       "topK": <int>
+    #   }
+    # }
+
+    def build_payload(self, input_data: dict) -> dict:
+        return {
+            "inputText": input_data["prompt"],
+            "textGenerationConfig": {
+                "maxTokenCount": input_data.get("max_tokens", 1024),
+                "temperature": input_data.get("temperature", 0.1),
+                "topP": input_data.get("top_p", 0.9),
+                "topK": input_data.get("top_k", 2)
+            }
+        }
+
+    def parse_response(self, result: dict) -> str:
+        # Extract the generated text from the Titan response
+        if "outputText" in result:
+            return result["outputText"]
+        return result["results"][0]["outputText"]
+
+    def token_usage(self, result: dict) -> tuple:
+        output_tokens = sum(item.get("tokenCount", 0) for item in result.get("results", []))
+        return result.get("inputTextTokenCount", 0), output_tokens
+
+    def parse_stream_chunk(self, chunk: dict) -> str:
+        return chunk.get("outputText", "")
+
+
+class LlamaAdapter(ModelAdapter):
+    ### llamas model expects a JSON body with this structure:
+    # {
+    #   "prompt": string,
+    #   "temperature": float,
+    #   "top_p": float,
+    #   "max_gen_len": int
+    # }
+
+    def build_payload(self, input_data: dict) -> dict:
+        return {
+            "prompt": input_data["prompt"],
+            "temperature": input_data.get("temperature", 0.5),
+            "top_p": input_data.get("top_p", 0.9),
+            "max_gen_len": input_data.get("max_tokens", 1024)
+        }
+
+    def parse_response(self, result: dict) -> str:
+        # Extract the generated text from the Llama response
+        if "text" in result:
+            return result["text"]
+        return result["generation"]
+
+    def token_usage(self, result: dict) -> tuple:
+        return result.get("prompt_token_count", 0), result.get("generation_token_count", 0)
+
+    def parse_stream_chunk(self, chunk: dict) -> str:
+        return chunk.get("generation", "")
+
+
+class ClaudeAdapter(ModelAdapter):
+    ### Claude model expects a JSON body with this structure:
+    # {
+    #   "max_tokens": 1024,
+    #   "system": "Today is January 1, 2024. Only respond in Haiku",
+    #   "messages": [{"role": "user", "content": "Hello, Claude"}],
+    #   "anthropic_version": "bedrock-2023-05-31"
+    # }
+
+    def build_payload(self, input_data: dict) -> dict:
+        return {
+            "max_tokens": input_data.get("max_tokens", 1024),
+            "system": input_data.get("system", ""),
+            "temperature": input_data.get("temperature", 0.1),
+            "top_p": input_data.get("top_p", 0.9),
+            "top_k": input_data.get("top_k", 2),
+            "messages": [
+                {"role": "user", "content": input_data["prompt"]}
+            ],
+            "anthropic_version": input_data.get("anthropic_version", "bedrock-2023-05-31")
+        }
+
+    def parse_response(self, result: dict) -> str:
+        # Extract the generated text from the Claude response
+        return result["content"][0]["text"] if isinstance(result["content"], list) else result["content"]
+
+    def token_usage(self, result: dict) -> tuple:
+        usage = result.get("usage", {})
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+
+    def parse_stream_chunk(self, chunk: dict) -> str:
+        if chunk.get("type") == "content_block_delta":
+            return chunk["delta"].get("text", "")
+        return ""
+
+
+class LocalModelAdapter(ModelAdapter):
+    """
+    Adapter answering in-process instead of calling Bedrock: requests are passed
+    to respond() and never reach the Bedrock client.
+    """
+
+    is_local = True
+
+    @abstractmethod
+    def respond(self, payload: dict) -> dict:
+        """
+        Returns the response body for payload.
+        """
+
+
+class FakeAdapter(LocalModelAdapter):
+    """
+    Deterministic local model for tests and benchmarks; no request leaves the process.
+
+    responder(prompt) returns the completion text (by default always "SELECT 1;")
+    and may raise to simulate errors; latency seconds are slept before answering.
+    Token counts are estimated at 4 characters per token.
+    """
+
+    def __init__(self, responder=None, latency: float = 0.0):
+        self.responder = responder or (lambda prompt: "SELECT 1;")
+        self.latency = latency
+
+    def build_payload(self, input_data: dict) -> dict:
+        return {
+            "prompt": input_data["prompt"],
+            "max_tokens": input_data.get("max_tokens", 1024),
+            "temperature": input_data.get("temperature", 0.1),
+        }
+
+    def respond(self, payload: dict) -> dict:
+        if self.latency:
+            time.sleep(self.latency)
+        text = self.responder(payload["prompt"])
+        return {
+            "completion": text,
+            "usage": {"input_tokens": len(payload["prompt"]) // 4, "output_tokens": len(text) // 4},
+        }
+
+    def parse_response(self, result: dict) -> str:
+        return result["completion"]
+
+    def token_usage(self, result: dict) -> tuple:
+        return result["usage"]["input_tokens"], result["usage"]["output_tokens"]
+
+    def parse_stream_chunk(self, chunk: dict) -> str:
+        return chunk.get("completion", "")
+
+
+# model id prefix -> adapter; the longest matching prefix wins
+_adapters = {
+    "amazon.titan-tg1": TitanAdapter(),
+    "amazon.titan-text": TitanAdapter(),
+    "meta.llama": LlamaAdapter(),
+    "anthropic.claude": ClaudeAdapter(),
+    "fake.": FakeAdapter(),
+}
+_adapters_lock = threading.Lock()
+
+
+def register_adapter(prefix: str, adapter: ModelAdapter = None):
+    """
+    Registers adapter for the model ids starting with prefix, replacing any adapter
+    registered for the same prefix. Passing None removes the prefix.
+    """
+    with _adapters_lock:
+        if adapter is None:
+            _adapters.pop(prefix, None)
+        else:
+            _adapters[prefix] = adapter
+
+
+def get_adapter(model_id: str) -> ModelAdapter:
+    """
+    Returns the adapter registered for the longest prefix of model_id
+    (ignoring a cross-region inference profile prefix).
+    """
+    base_id = model_id
+    for geography in INFERENCE_PROFILE_PREFIXES:
+        if model_id.startswith(geography):
+            base_id = model_id[len(geography):]
+            break
+
+    with _adapters_lock:
+        matches = [prefix for prefix in _adapters if base_id.startswith(prefix)]
+        if not matches:
+            raise ValueError(f"Model ID '{model_id}' not recognized.")
+        return _adapters[max(matches, key=len)]
+
+
+# model id -> token counters of the calls answered by the model (cache hits excluded)
+_token_usage = {}
+_token_usage_lock = threading.Lock()
+
+
+def record_token_usage(model_id: str, input_tokens: int, output_tokens: int):
+    with _token_usage_lock:
+        usage = _token_usage.setdefault(model_id, {"calls": 0, "input_tokens": 0, "output_tokens": 0})
+        usage["calls"] += 1
+        usage["input_tokens"] += input_tokens
+        usage["output_tokens"] += output_tokens
+
+
+def token_usage_stats() -> dict:
+    """
+    Returns the calls and token counts recorded so far, keyed by model_id.
+    """
+    with _token_usage_lock:
+        return {model_id: dict(usage) for model_id, usage in _token_usage.items()}
@@ -0,0 +1,254 @@
+import argparse
+import os
+import shutil
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+
+from llm.clean_output import clean_sql_for_execution
+from llm.llm_request import build_payload, parse_response, invoke_model_payload
+from llm.run_llm_exp import GENERATION_PARAMS, build_question_prompt, make_record
+from pgdb.pg_utils import is_valid_sql
+from pipeline.concurrency import ordered_map
+from pipeline.jsonl import read_records, write_records, dumps_record
+
+# Terminal states of a Bedrock model invocation job
+BATCH_DONE_STATES = {"Completed", "PartiallyCompleted"}
+BATCH_FAILED_STATES = {"Failed", "Stopped", "Expired"}
+
+
+class BatchBackend(ABC):
+    """
+    Submission/poll layer of a batch inference job over a JSONL input file with
+    {"recordId": ..., "modelInput": <payload>} lines. The output file holds the
+    same lines with an added "modelOutput" (or "error").
+    """
+
+    @abstractmethod
+    def submit(self, input_file: str, model_id: str, job_name: str) -> str:
+        """Submits the job and returns its identifier."""
+
+    @abstractmethod
+    def status(self, job_id: str) -> str:
+        """Returns the job status (Bedrock status names)."""
+
+    @abstractmethod
+    def fetch_output(self, job_id: str, output_file: str) -> str:
+        """Stores the job output JSONL at output_file and returns its path."""
+
+
+class BedrockBatchBackend(BatchBackend):
+    """
+    Runs the job with Bedrock batch inference (create_model_invocation_job).
+    The input is uploaded under s3_input_uri and the output is read back from s3_output_uri;
+    role_arn must allow Bedrock to access both.
+    """
+
+    def __init__(self, s3_input_uri: str, s3_output_uri: str, role_arn: str, region_name: str = None):
+        import boto3
+
+        session = boto3.Session(region_name=region_name or os.getenv("BEDROCK_REGION", "us-east-1"))
+        self.bedrock = session.client(service_name="bedrock")
+        self.s3 = session.client(service_name="s3")
+        self.s3_input_uri = s3_input_uri.rstrip("/")
+        self.s3_output_uri = s3_output_uri.rstrip("/")
+        self.role_arn = role_arn
+        self._input_names = {}
+
+    @staticmethod
+    def _split_s3_uri(uri: str):
+        bucket, _, key = uri.removeprefix("s3://").partition("/")
+        return bucket, key
+
+    def submit(self, input_file: str, model_id: str, job_name: str) -> str:
+        input_name = os.path.basename(input_file)
+        input_uri = f"{self.s3_input_uri}/{job_name}/{input_name}"
+        bucket, key = self._split_s3_uri(input_uri)
+        self.s3.upload_file(input_file, bucket, key)
+
+        response = self.bedrock.create_model_invocation_job(
+            jobName=job_name,
+            roleArn=self.role_arn,
+            modelId=model_id,
+            inputDataConfig={"s3InputDataConfig": {"s3Uri": input_uri}},
+            outputDataConfig={"s3OutputDataConfig": {"s3Uri": f"{self.s3_output_uri}/"}},
+        )
+        job_id = response["jobArn"]
+        self._input_names[job_id] = input_name
+        return job_id
+
+    def status(self, job_id: str) -> str:
+        return self.bedrock.get_model_invocation_job(jobIdentifier=job_id)["status"]
+
+    def fetch_output(self, job_id: str, output_file: str) -> str:
+        # Bedrock writes <output uri>/<job id>/<input file name>.out
+        output_uri = f"{self.s3_output_uri}/{job_id.split('/')[-1]}/{self._input_names[job_id]}.out"
+        bucket, key = self._split_s3_uri(output_uri)
+        self.s3.download_file(bucket, key, output_file)
+        return output_file
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File-based stand-in for Bedrock batch inference.
+
+    Jobs live in work_dir/<job id>/. Submitting copies the input there and returns
+    at once, while a background thread runs every record through
+    responder(payload, model_id) -> decoded response body, which by default calls
+    invoke_model on the shared client (so it can target a local fake endpoint via
+    BEDROCK_ENDPOINT_URL). As with Bedrock, the job is "InProgress" until the output
+    is fully written in the Bedrock format, then "Completed" (or "Failed").
+    """
+
+    def __init__(self, work_dir: str, responder=None):
+        self.work_dir = work_dir
+        self.responder = responder or invoke_model_payload
+
+    def _set_status(self, job_id: str, status: str):
+        status_file = os.path.join(self.work_dir, job_id, "status")
+        with open(f"{status_file}.tmp", "w", encoding="utf-8") as f:
+            f.write(status)
+        os.replace(f"{status_file}.tmp", status_file)
+
+    def _run(self, job_id: str, job_input: str, model_id: str):
+        try:
+            with open(f"{job_input}.out", "w", encoding="utf-8") as fout:
+                for record in read_records(job_input):
+                    try:
+                        record["modelOutput"] = self.responder(record["modelInput"], model_id)
+                    except Exception as err:
+                        record["error"] = {"errorMessage": str(err)}
+                    fout.write(dumps_record(record) + "\n")
+        except Exception as err:
+            print(f"[BATCH] Local job {job_id} failed: {err}")
+            self._set_status(job_id, "Failed")
+            return
+        self._set_status(job_id, "Completed")
+
+    def submit(self, input_file: str, model_id: str, job_name: str) -> str:
+        job_dir = os.path.join(self.work_dir, job_name)
+        os.makedirs(job_dir, exist_ok=True)
+        job_input = os.path.join(job_dir, os.path.basename(input_file))
+        shutil.copyfile(input_file, job_input)
+
+        self._set_status(job_name, "InProgress")
+        threading.Thread(target=self._run, args=(job_name, job_input, model_id), daemon=True).start()
+        return job_name
+
+    def status(self, job_id: str) -> str:
+        status_file = os.path.join(self.work_dir, job_id, "status")
+        if not os.path.exists(status_file):
+            return "InProgress"
+        with open(status_file, "r", encoding="utf-8") as f:
+            return f.read().strip()
+
+    def fetch_output(self, job_id: str, output_file: str) -> str:
+        job_dir = os.path.join(self.work_dir, job_id)
+        outputs = [name for name in os.listdir(job_dir) if name.endswith(".out")]
+        shutil.copyfile(os.path.join(job_dir, outputs[0]), output_file)
+        return output_file
+
+
+def write_batch_input(questions, batch_input_file: str, model_id: str, schema_pruning_radius: int = None) -> int:
+    """
+    Writes one batch record per question, keyed by question_id, and returns the number of records.
+    """
+    def batch_records():
+        for question in questions:
+            prompt = build_question_prompt(question, schema_pruning_radius)
+            yield {
+                "recordId": str(question["question_id"]),
+                "modelInput": build_payload({"prompt": prompt, **GENERATION_PARAMS}, model_id),
+            }
+
+    return write_records(batch_input_file, batch_records())
+
+
+def read_batch_output(batch_output_file: str, model_id: str) -> dict:
+    """
+    Returns the generated text of every successful batch record, keyed by recordId.
+    """
+    outputs = {}
+    for record in read_records(batch_output_file):
+        if "modelOutput" in record:
+            outputs[record["recordId"]] = parse_response(record["modelOutput"], model_id)
+        else:
+            print(f"[BATCH] Record {record['recordId']} failed: {record.get('error')}")
+    return outputs
+
+
+def wait_for_batch_job(backend: BatchBackend, job_id: str, poll_interval: float = 60.0) -> str:
+    while True:
+        status = backend.status(job_id)
+        if status in BATCH_DONE_STATES:
+            return status
+        if status in BATCH_FAILED_STATES:
+            raise RuntimeError(f"Batch job {job_id} ended with status {status}")
+        print(f"[BATCH] Job {job_id} is {status}, waiting {poll_interval}s...")
+        time.sleep(poll_interval)
+
+
+def run_llm_batch_process(input_file: str, output_file: str, model_id: str, backend: BatchBackend,
+                          work_dir: str = "results/batch", poll_interval: float = 60.0,
+                          max_workers: int = 1, schema_pruning_radius: int = None):
+    """
+    Bulk alternative to run_llm_process: sends every question in a single batch
+    inference job, waits for it, validates the generated SQL and writes the same
+    records as run_llm_process (one attempt per question, in input order), so the
+    output feeds the same cleaning and evaluation stages.
+    Questions without an output are recorded with an empty text_2_sql and is_valid False.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    job_name = f"txt2sql-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    batch_input_file = os.path.join(work_dir, f"{job_name}.jsonl")
+    batch_output_file = os.path.join(work_dir, f"{job_name}.jsonl.out")
+
+    count = write_batch_input(read_records(input_file), batch_input_file, model_id, schema_pruning_radius)
+    print(f"[BATCH] Wrote {count} records to {batch_input_file}")
+
+    job_id = backend.submit(batch_input_file, model_id, job_name)
+    print(f"[BATCH] Submitted job {job_id}")
+    status = wait_for_batch_job(backend, job_id, poll_interval)
+    print(f"[BATCH] Job {job_id} is {status}")
+
+    outputs = read_batch_output(backend.fetch_output(job_id, batch_output_file), model_id)
+
+    def validate(question):
+        prompt = build_question_prompt(question, schema_pruning_radius)
+        txt2sql = outputs.get(str(question["question_id"]))
+        if txt2sql is None:
+            return make_record(question, "", prompt, 1, False)
+        is_valid = is_valid_sql(clean_sql_for_execution(str(txt2sql)), question["db_id"])
+        return make_record(question, txt2sql, prompt, 1, is_valid)
+
+    records = ordered_map(validate, read_records(input_file), max_workers=max_workers)
+    write_records(output_file, records)
+
+    print(f"[BATCH] All responses saved to {output_file}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run LLM generation as a batch inference job.")
+    parser.add_argument("--input_file", type=str, default="data/dev_enriched.json", help="Path to the questions.")
+    parser.add_argument("--output_file", type=str, default="results/dev_enriched_raw.jsonl",
+                        help="Path to save the LLM responses.")
+    parser.add_argument("--model_id", type=str, default="anthropic.claude-3-5-sonnet-20240620-v1:0",
+                        help="Bedrock model ID.")
+    parser.add_argument("--backend", type=str, default="bedrock", choices=["bedrock", "local"],
+                        help="Bedrock batch inference or the local file-based stand-in.")
+    parser.add_argument("--work_dir", type=str, default="results/batch", help="Directory for batch files.")
+    parser.add_argument("--s3_input_uri", type=str, default=None, help="S3 prefix for the batch input.")
+    parser.add_argument("--s3_output_uri", type=str, default=None, help="S3 prefix for the batch output.")
+    parser.add_argument("--role_arn", type=str, default=None, help="IAM role used by the batch job.")
+    parser.add_argument("--poll_interval", type=float, default=60.0, help="Seconds between status checks.")
+    parser.add_argument("--max_workers", type=int, default=1, help="Concurrent SQL validations.")
+    args = parser.parse_args()
+
+    if args.backend == "local":
+        batch_backend = LocalBatchBackend(os.path.join(args.work_dir, "jobs"))
+    else:
+        batch_backend = BedrockBatchBackend(args.s3_input_uri, args.s3_output_uri, args.role_arn)
+
+    run_llm_batch_process(args.input_file, args.output_file, args.model_id, batch_backend,
+                          work_dir=args.work_dir, poll_interval=args.poll_interval, max_workers=args.max_workers)
@@ -1,6 +1,7 @@
-import json
 import re
 
+from pipeline.jsonl import read_records, write_records
+
 def clean_sql_for_execution(sql: str) -> str:
     """
     Clean LLM-generated SQL to remove markdown, trailing junk, and incomplete clauses.
@@ -19,22 +20,20 @@ def clean_sql_for_execution(sql: str) -> str:
 
 
 
-def clean_llm_output(input_file: str, output_file: str, model_id: str = None):
+def clean_records(records):
+    """
+    Yields the LLM output records with whitespace normalized and the predicted SQL
+    cleaned for execution, one record at a time.
+    """
     fields_to_clean = ["true_sql", "text_2_sql", "prompt"]
 
-    with open(input_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    if isinstance(data, dict):
-        data = [data]
-
-    for item in data:
+    for item in records:
         for field in fields_to_clean:
             if field in item and item[field]:
                 item[field] = " ".join(item[field].split())
 
-        # Clean predicted SQL
-        if "text_2_sql" in item:
+        # Clean predicted SQL (None when the model gave no output)
+        if item.get("text_2_sql") is not None:
             item["text_2_sql"] = clean_sql_for_execution(item["text_2_sql"])
 
         # Clean generation inside response_metadata
@@ -43,7 +42,11 @@ def clean_llm_output(input_file: str, output_file: str, model_id: str = None):
             if gen_text:
                 item["response_metadata"]["generation"] = " ".join(gen_text.split())
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+        yield item
+
+
+def clean_llm_output(input_file: str, output_file: str, model_id: str = None):
+    # Records are streamed from input_file to output_file (JSONL or legacy JSON array)
+    write_records(output_file, clean_records(read_records(input_file)))
 
     print(f"[CLEAN] Cleaned output saved to {output_file}")
@@ -1,8 +1,132 @@
 import json
+import os
+import threading
+
 import boto3
+from botocore.config import Config
+
+from llm.adapters import get_adapter, record_token_usage
+from llm.cache import CompletionCache, payload_key
+from llm.rate_limit import get_rate_limiter, estimate_tokens
+from pipeline.metrics import timed, increment
+
+# Shared bedrock-runtime clients keyed by (region_name, profile_name).
+# boto3 clients are thread-safe, sessions are not, so clients are created under a lock
+# and then reused by every caller (and thread) for the rest of the process.
+_bedrock_clients = {}
+_bedrock_clients_lock = threading.Lock()
+
+BEDROCK_REGION = os.getenv("BEDROCK_REGION", "us-east-1")
+BEDROCK_PROFILE = os.getenv("BEDROCK_PROFILE")
+# Optional endpoint override, e.g. a local stand-in for Bedrock
+BEDROCK_ENDPOINT_URL = os.getenv("BEDROCK_ENDPOINT_URL")
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.getenv("BEDROCK_MAX_POOL_CONNECTIONS", "50"))
+
+
+def get_bedrock_client(region_name: str = None, profile_name: str = None):
+    """
+    Returns the shared bedrock-runtime client for the given region/profile,
+    creating it on first use.
+
+    The client keeps a pool of up to BEDROCK_MAX_POOL_CONNECTIONS keep-alive
+    HTTP connections, so concurrent callers reuse TLS connections instead of
+    paying credential resolution and connection setup on every request.
+    botocore's own retries are disabled: call_llm_model retries through the rate limiter.
+    """
+    key = (region_name or BEDROCK_REGION, profile_name or BEDROCK_PROFILE)
+    client = _bedrock_clients.get(key)
+    if client is not None:
+        return client
+
+    with _bedrock_clients_lock:
+        client = _bedrock_clients.get(key)
+        if client is None:
+            session = boto3.Session(region_name=key[0], profile_name=key[1])
+            client = session.client(
+                service_name="bedrock-runtime",
+                endpoint_url=BEDROCK_ENDPOINT_URL,
+                config=Config(
+                    max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS,
+                    tcp_keepalive=True,
+                    # Retries are handled by the rate limiter, which needs to see every throttle
+                    retries={"mode": "standard", "max_attempts": 1},
+                ),
+            )
+            _bedrock_clients[key] = client
+    return client
+
+
+def set_bedrock_client(client, region_name: str = None, profile_name: str = None):
+    """
+    Registers client as the shared bedrock-runtime client for the given region/profile,
+    e.g. to replace Bedrock with a local stub. Passing None drops the registered client.
+    """
+    key = (region_name or BEDROCK_REGION, profile_name or BEDROCK_PROFILE)
+    with _bedrock_clients_lock:
+        if client is None:
+            _bedrock_clients.pop(key, None)
+        else:
+            _bedrock_clients[key] = client
+
+
+# Optional completion cache shared by all callers of call_llm_model (disabled by default)
+_completion_cache = None
+
+
+def set_completion_cache(cache: CompletionCache = None):
+    """
+    Enables the given completion cache for call_llm_model, or disables caching when None.
+    """
+    global _completion_cache
+    _completion_cache = cache
+
+
+def get_completion_cache():
+    return _completion_cache
+
+
+def build_payload(input_data: dict, model_id: str) -> dict:
+    """
+    Builds the model specific request body for input_data
+    (a dict with a 'prompt' and optional sampling parameters).
+    """
+    return get_adapter(model_id).build_payload(input_data)
+
+
+def parse_response(result: dict, model_id: str) -> str:
+    """
+    Extracts the generated text from a decoded model response body.
+    """
+    return get_adapter(model_id).parse_response(result)
+
+
+def invoke_model_payload(payload: dict, model_id: str, client=None) -> dict:
+    """
+    Sends a built payload to the model with invoke_model and returns the decoded response body.
+    Models with a local adapter (e.g. "fake.*") answer in-process.
+    """
+    adapter = get_adapter(model_id)
+    if adapter.is_local:
+        return adapter.respond(payload)
 
+    # Reuse the shared client (region/profile come from BEDROCK_REGION / BEDROCK_PROFILE)
+    bedrock_client = client or get_bedrock_client()
 
-def call_llm_model(input_data: dict, model_id: str = "amazon.titan-tg1-large") -> dict:
+    response = bedrock_client.invoke_model(
+        modelId=model_id,
+        accept="application/json",
+        contentType="application/json",
+        body=json.dumps(payload)
+    )
+
+    # The response "body" is a StreamingBody. We need to read and decode it.
+    response_body = response["body"].read().decode("utf-8")
+    return json.loads(response_body)
+
+
+@timed("call_llm_model", label=lambda input_data, model_id="amazon.titan-tg1-large", *args, **kwargs: model_id)
+def call_llm_model(input_data: dict, model_id: str = "amazon.titan-tg1-large", client=None,
+                   bypass_cache: bool = False, cache_variant: str = None) -> dict:
     """
     Calls the Amazon Titan model on AWS Bedrock using Boto3.
 
@@ -13,100 +137,94 @@ def call_llm_model(input_data: dict, model_id: str = "amazon.titan-tg1-large") -
                         For Titan, options might include:
                         "amazon.titan-tg1-large",
                         "amazon.titan-tg1-xlarge", etc.
+        client: Optional bedrock-runtime client to use instead of the shared one.
+        bypass_cache (bool): Skip the completion cache lookup and always call the model.
+                             The fresh completion still replaces the cached one.
+        cache_variant (str): Caches the completion apart from other completions of the
+                             same request (see payload_key).
+
+    The request body and response handling come from the adapter registered for
+    the model_id prefix (see llm.adapters). Calls go through the shared rate limiter
+    of model_id (see llm.rate_limit), which paces them and retries throttled or
+    transient failures with backoff.
 
     Returns:
         dict: The raw response from the LLM.
     """
-    # Create an AWS session (if needed, you can pass AWS creds/region directly to the session)
-    session = boto3.Session(region_name="us-east-1")  # or "us-west-2"
-    bedrock_client = session.client(service_name="bedrock-runtime")
-
-    ### The Titan text model typically expects a JSON body with this structure:
-    # {
-    #   "inputText": "<your prompt>"
-    #   "textGenerationConfig": {
-    #       "maxTokenCount": <int>,
-    #       "temperature": <float>,
-    #       "topP": <float>,
-    #       "topK": <int>
-    #   }
-    # }
-
-    ### llamas model expects a JSON body with this structure:
-    # {
-    #   "prompt": string,
-    #   "temperature": float,
-    #   "top_p": float,
-    #   "max_gen_len": int
-    # }
-
-    ### Claude model expects a JSON body with this structure:
-    # {
-    #   "max_tokens": 1024,
-    #   "system": "Today is January 1, 2024. Only respond in Haiku",
-    #   "messages": [{"role": "user", "content": "Hello, Claude"}],
-    #   "anthropic_version": "bedrock-2023-05-31"
-    # }
-
     # Prepare the payload
-    match model_id:
-        case "amazon.titan-tg1-large":
-            payload = {
-                "inputText": input_data["prompt"],
-                "textGenerationConfig": {
-                    "maxTokenCount": input_data.get("max_tokens", 1024),
-                    "temperature": input_data.get("temperature", 0.1),
-                    "topP": input_data.get("top_p", 0.9),
-                    "topK": input_data.get("top_k", 2)
-                }
-            }
-        case "meta.llama3-70b-instruct-v1:0":
-            payload = {
-                "prompt": input_data["prompt"],
-                "temperature": input_data.get("temperature", 0.5),
-                "top_p": input_data.get("top_p", 0.9),
-                "max_gen_len": input_data.get("max_tokens", 1024)
-            }
-        case "anthropic.claude-3-5-sonnet-20240620-v1:0":
-            payload = {
-                "max_tokens": input_data.get("max_tokens", 1024),
-                "system": input_data.get("system", ""),
-                "temperature": input_data.get("temperature", 0.1),
-                "top_p": input_data.get("top_p", 0.9),
-                "top_k": input_data.get("top_k", 2),
-                "messages": [
-                    {"role": "user", "content": input_data["prompt"]}
-                ],
-                "anthropic_version": input_data.get("anthropic_version", "bedrock-2023-05-31")
-            }
-        case _:
-            raise ValueError(f"Model ID '{model_id}' not recognized.")
-
-    # Invoke the model
-    response = bedrock_client.invoke_model(
-        modelId=model_id,
-        accept="application/json",
-        contentType="application/json",
-        body=json.dumps(payload)
+    payload = build_payload(input_data, model_id)
+
+    # Serve identical requests from the completion cache, if enabled
+    cache = _completion_cache
+    cache_key = payload_key(model_id, payload, cache_variant) if cache is not None else None
+    if cache is not None and not bypass_cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            increment("call_llm_model.cache_hits", label=model_id)
+            return cached
+
+    # Invoke the model under the model's rate limiter and adapt the response to the model id
+    adapter = get_adapter(model_id)
+    response = get_rate_limiter(model_id).call(
+        lambda: invoke_model_payload(payload, model_id, client),
+        tokens=estimate_tokens(input_data),
     )
+    record_token_usage(model_id, *adapter.token_usage(response))
+    result = adapter.parse_response(response)
 
-    # The response "body" is a StreamingBody. We need to read and decode it.
-    response_body = response["body"].read().decode("utf-8")
-    result = json.loads(response_body)
-
-    # Adapt the response to the model id
-
-    match model_id:
-        case "amazon.titan-tg1-large":
-            # Extract the generated text from the Titan response
-            result = result["outputText"]
-        case "meta.llama3-70b-instruct-v1:0":
-            # Extract the generated text from the Llama response
-            result = result["text"]
-        case "anthropic.claude-3-5-sonnet-20240620-v1:0":
-            # Extract the generated text from the Claude response
-            result = result["content"][0]["text"] if isinstance(result["content"], list) else result["content"]
-        case _:
-            raise ValueError(f"Model ID '{model_id}' not recognized.")
+    if cache is not None:
+        cache.put(cache_key, model_id, result)
 
     return result
+
+
+def cached_completion(input_data: dict, model_id: str, cache_variant: str = None):
+    """
+    Returns the completion call_llm_model would serve from the completion cache for
+    this request, or None on a miss (or when no cache is set); the model is not called.
+    """
+    cache = _completion_cache
+    if cache is None:
+        return None
+    cached = cache.get(payload_key(model_id, build_payload(input_data, model_id), cache_variant))
+    if cached is not None:
+        increment("call_llm_model.cache_hits", label=model_id)
+    return cached
+
+
+def call_llm_model_stream(input_data: dict, model_id: str, client=None):
+    """
+    Calls the model with invoke_model_with_response_stream and yields the generated
+    text as it arrives. The stream is not cached; token usage is recorded from the
+    invocation metrics of the last chunk. Local adapters yield their whole answer at once.
+    """
+    adapter = get_adapter(model_id)
+    if not adapter.supports_streaming:
+        raise ValueError(f"Model ID '{model_id}' does not support streaming.")
+
+    payload = adapter.build_payload(input_data)
+    if adapter.is_local:
+        result = get_rate_limiter(model_id).call(lambda: adapter.respond(payload))
+        record_token_usage(model_id, *adapter.token_usage(result))
+        yield adapter.parse_response(result)
+        return
+
+    bedrock_client = client or get_bedrock_client()
+    response = get_rate_limiter(model_id).call(
+        lambda: bedrock_client.invoke_model_with_response_stream(
+            modelId=model_id,
+            accept="application/json",
+            contentType="application/json",
+            body=json.dumps(payload)
+        ),
+        tokens=estimate_tokens(input_data),
+    )
+
+    for event in response["body"]:
+        chunk = json.loads(event["chunk"]["bytes"].decode("utf-8"))
+        usage = adapter.stream_token_usage(chunk)
+        if usage is not None:
+            record_token_usage(model_id, *usage)
+        text = adapter.parse_stream_chunk(chunk)
+        if text:
+            yield text
@@ -1,25 +1,32 @@
-from pgdb.pg_utils import connect_postgresql, db_table_map, format_postgresql_create_table
+from llm.schema import get_schema_provider
+from pipeline.metrics import timed
 
 
-def generate_schema_prompt(db_path):
-    db = connect_postgresql()
-    cursor = db.cursor()
+def load_table_schemas(db_name):
+    """
+    Returns a dict mapping every table of db_name to its CREATE TABLE statement,
+    as built (and cached) by the current schema provider.
+    """
+    return get_schema_provider().table_schemas(db_name)
+
+
+def invalidate_schema_cache(db_name=None):
+    """
+    Drops the cached schemas of db_name (or of every database when None).
+    """
+    get_schema_provider().invalidate(db_name)
+
+
+@timed("generate_schema_prompt", label=lambda db_path, tables=None: db_path)
+def generate_schema_prompt(db_path, tables=None):
+    """
+    Returns the CREATE TABLE statements of the database, restricted to tables if given.
+    """
     db_name = db_path.split("/")[-1].split(".sqlite")[0]
-    tables = [table for table in db_table_map[db_name]]
-    schemas = {}
-    for table in tables:
-        cursor.execute(
-            f"""
-                SELECT column_name, data_type, is_nullable
-                FROM information_schema.columns
-                WHERE table_name = '{table}';
-            """
-        )
-        raw_schema = cursor.fetchall()
-        pretty_schema = format_postgresql_create_table(table, raw_schema)
-        schemas[table] = pretty_schema
+    schemas = load_table_schemas(db_name)
+    if tables is not None:
+        schemas = {table: schema for table, schema in schemas.items() if table in tables}
     schema_prompt = "\n\n".join(schemas.values())
-    db.close()
     return schema_prompt
 
 
@@ -50,8 +57,13 @@ def generate_instruction_prompt(sql_dialect):
         """
 
 
-def generate_combined_prompts(db_path, question, sql_dialect, knowledge=None):
-    schema_prompt = generate_schema_prompt(db_path)
+def generate_combined_prompts(db_path, question, sql_dialect, knowledge=None, tables=None, schema_prompt=None):
+    """
+    Returns the full text-to-SQL prompt. schema_prompt, if given, is used instead of
+    rendering the schema of db_path again.
+    """
+    if schema_prompt is None:
+        schema_prompt = generate_schema_prompt(db_path, tables)
     comment_prompt = generate_comment_prompt(question, sql_dialect, knowledge)
     cot_prompt = generate_cot_prompt(sql_dialect)
     instruction_prompt = generate_instruction_prompt(sql_dialect)
@@ -60,3 +72,23 @@ def generate_combined_prompts(db_path, question, sql_dialect, knowledge=None):
         [schema_prompt, comment_prompt, cot_prompt, instruction_prompt]
     )
     return combined_prompts
+
+
+# Longest database error message quoted in a repair prompt
+REPAIR_ERROR_MAX_CHARS = 500
+
+
+def generate_repair_prompt(schema_prompt, question, sql_dialect, failed_sql, error, knowledge=None):
+    """
+    Returns a compact prompt asking to fix failed_sql, quoting the database error.
+    The already rendered schema_prompt is reused; the step by step request is left out.
+    """
+    comment_prompt = generate_comment_prompt(question, sql_dialect, knowledge)
+    repair_prompt = (
+        f"-- The following query failed:\n{failed_sql}\n"
+        f"-- Error: {error[:REPAIR_ERROR_MAX_CHARS]}\n"
+        f"-- Fix the query so that it answers the question and runs without errors."
+    )
+    instruction_prompt = generate_instruction_prompt(sql_dialect)
+
+    return "\n\n".join([schema_prompt, comment_prompt, repair_prompt, instruction_prompt])
@@ -0,0 +1,241 @@
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import ConnectionClosedError, EndpointConnectionError, ReadTimeoutError
+
+# Default per-model quotas; 0 disables the corresponding bucket
+BEDROCK_RPM = float(os.getenv("BEDROCK_RPM", "0"))
+BEDROCK_TPM = float(os.getenv("BEDROCK_TPM", "0"))
+# Upper bound and starting point of the adaptive concurrency limit
+BEDROCK_MAX_CONCURRENCY = int(os.getenv("BEDROCK_MAX_CONCURRENCY", "32"))
+BEDROCK_INITIAL_CONCURRENCY = int(os.getenv("BEDROCK_INITIAL_CONCURRENCY", "4"))
+BEDROCK_MAX_RETRIES = int(os.getenv("BEDROCK_MAX_RETRIES", "8"))
+BEDROCK_BACKOFF_BASE = float(os.getenv("BEDROCK_BACKOFF_BASE", "1.0"))
+BEDROCK_BACKOFF_MAX = float(os.getenv("BEDROCK_BACKOFF_MAX", "60.0"))
+
+# Error codes meaning "slow down": they shrink the concurrency limit
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException"}
+# Error codes worth retrying without shrinking the concurrency limit
+TRANSIENT_ERROR_CODES = {"ServiceUnavailableException", "InternalServerException", "ModelNotReadyException",
+                         "ModelTimeoutException"}
+TRANSIENT_EXCEPTIONS = (ConnectionClosedError, EndpointConnectionError, ReadTimeoutError)
+
+
+def error_code(err: Exception):
+    """
+    Returns the AWS error code of a botocore ClientError, or None for any other
+    exception (including ones whose response attribute is not a dict, e.g. HTTP errors).
+    """
+    response = getattr(err, "response", None)
+    if not isinstance(response, dict):
+        return None
+    return (response.get("Error") or {}).get("Code")
+
+
+def estimate_tokens(input_data: dict) -> int:
+    """
+    Rough token cost of a request: about 4 characters per prompt token plus the
+    requested completion length, which Bedrock reserves against the TPM quota.
+    """
+    prompt = input_data.get("system", "") + input_data.get("prompt", "")
+    return len(prompt) // 4 + input_data.get("max_tokens", 1024)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate_per_minute, holding at most one minute of tokens.
+
+    acquire() reserves the tokens immediately, letting the balance go negative,
+    and sleeps until the balance is paid back; concurrent callers therefore
+    queue up in arrival order instead of racing for refills.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """
+        Takes amount tokens, waiting if needed, and returns the seconds waited.
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit adjusted with AIMD: every success adds 1/limit (about +1 per
+    limit successful calls), every throttle multiplies the limit by decrease.
+    """
+
+    def __init__(self, initial: int, maximum: int, minimum: int = 1, decrease: float = 0.5):
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.maximum = maximum
+        self.minimum = minimum
+        self.decrease = decrease
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> float:
+        """
+        Waits for a free slot and returns the seconds waited.
+        """
+        start = time.monotonic()
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        return time.monotonic() - start
+
+    def release(self, throttled: bool = False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+
+class RateLimiter:
+    """
+    Client-side limiter for the calls to one model.
+
+    Every call waits for the requests/min and tokens/min buckets and for a slot
+    of the adaptive concurrency limit, then runs. Throttling and transient errors
+    are retried with full-jitter exponential backoff, up to max_retries times;
+    throttles also shrink the concurrency limit, so the limiter settles just
+    below the account quota. Counters are exposed through stats().
+    """
+
+    def __init__(self, rpm: float = BEDROCK_RPM, tpm: float = BEDROCK_TPM,
+                 max_concurrency: int = BEDROCK_MAX_CONCURRENCY,
+                 initial_concurrency: int = BEDROCK_INITIAL_CONCURRENCY,
+                 max_retries: int = BEDROCK_MAX_RETRIES,
+                 backoff_base: float = BEDROCK_BACKOFF_BASE, backoff_max: float = BEDROCK_BACKOFF_MAX):
+        self.requests_bucket = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens_bucket = TokenBucket(tpm) if tpm > 0 else None
+        self.concurrency = AdaptiveConcurrency(initial_concurrency, max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.requests = 0
+        self.throttles = 0
+        self.transient_errors = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+        self.backoff_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Full-jitter exponential backoff delay for the given retry attempt (0-based).
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def call(self, fn, tokens: int = 0):
+        """
+        Runs fn() under the limits, retrying on throttling and transient errors.
+        """
+        attempt = 0
+        while True:
+            waited = 0.0
+            if self.requests_bucket is not None:
+                waited += self.requests_bucket.acquire(1)
+            if self.tokens_bucket is not None and tokens:
+                waited += self.tokens_bucket.acquire(tokens)
+            waited += self.concurrency.acquire()
+            self._count(requests=1, wait_seconds=waited)
+
+            throttled = False
+            try:
+                return fn()
+            except Exception as err:
+                code = error_code(err)
+                reason = code or type(err).__name__
+                throttled = code in THROTTLING_ERROR_CODES
+                transient = code in TRANSIENT_ERROR_CODES or isinstance(err, TRANSIENT_EXCEPTIONS)
+                if throttled:
+                    self._count(throttles=1)
+                elif transient:
+                    self._count(transient_errors=1)
+
+                if not (throttled or transient) or attempt >= self.max_retries:
+                    self._count(failures=1)
+                    raise
+            finally:
+                self.concurrency.release(throttled)
+
+            delay = self.backoff(attempt)
+            print(f"[LLM] {reason}, retrying in {delay:.1f}s (attempt {attempt + 1})")
+            self._count(backoff_seconds=delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "throttles": self.throttles,
+                "transient_errors": self.transient_errors,
+                "failures": self.failures,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "backoff_seconds": round(self.backoff_seconds, 3),
+                "concurrency_limit": round(self.concurrency.limit, 2),
+            }
+
+
+# Shared limiters keyed by model_id
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model_id: str) -> RateLimiter:
+    """
+    Returns the shared limiter of model_id, created with the BEDROCK_* defaults on first use.
+    """
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(model_id)
+        if limiter is None:
+            limiter = _rate_limiters[model_id] = RateLimiter()
+        return limiter
+
+
+def set_rate_limiter(model_id: str, limiter: RateLimiter = None):
+    """
+    Registers limiter for model_id, e.g. with the quotas of a specific model.
+    Passing None drops the registered limiter, so the defaults apply again.
+    """
+    with _rate_limiters_lock:
+        if limiter is None:
+            _rate_limiters.pop(model_id, None)
+        else:
+            _rate_limiters[model_id] = limiter
+
+
+def rate_limiter_stats() -> dict:
+    """
+    Returns the stats of every limiter created so far, keyed by model_id.
+    """
+    with _rate_limiters_lock:
+        limiters = dict(_rate_limiters)
+    return {model_id: limiter.stats() for model_id, limiter in limiters.items()}
@@ -1,79 +1,357 @@
 # run_llm_exp.py
 
 import argparse
-import json
-import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from llm.llm_request import call_llm_model
-from llm.prompt import generate_combined_prompts
-from pgdb.pg_utils import is_valid_sql
+from llm.adapters import token_usage_stats
+from llm.llm_request import call_llm_model, cached_completion
+from llm.rate_limit import get_rate_limiter
+from llm.prompt import generate_combined_prompts, generate_repair_prompt, generate_schema_prompt
+from llm.schema import prune_tables, create_schema_provider, get_schema_provider, set_schema_provider
+from pgdb.pg_utils import is_valid_sql, validate_sql, query_result_fingerprint
 from llm.clean_output import clean_sql_for_execution
+from pipeline.concurrency import ordered_map
+from pipeline.journal import Journal, stage_signature
+from pipeline.jsonl import read_records, write_records
+from pipeline.metrics import timed, increment
 
 
-def run_llm_process(input_file: str, output_file: str, model_id: str, generation_retries: int = 3):
-    # 1. Read input data (JSON list of questions)
-    with open(input_file, "r", encoding="utf-8") as f:
-        questions = json.load(f)
-
-    all_responses = []
-
-    # 2. Process each question in the input
-    for question in questions:
-        # Create a combined prompt for schema alignment.
-        # We can embed db_id, question text, and any evidence or knowledge
-
-        prompt = generate_combined_prompts(
-            db_path=question["db_id"],
-            question=question["question"],
-            sql_dialect='PostgreSQL',
-            knowledge=question["token_column_mapping"],
-        )
-
-        # check if the SQL query is valid for generation_retries and retry if not
-        for _ in range(generation_retries):
-            # 3. Call the LLM model
-            txt2sql = call_llm_model({
-                "prompt": prompt,
-                "temperature": 0.1,
-                "max_tokens": 1024,
-                "top_k": 2,
-                "top_p": 0.9,
-            }, model_id=model_id)
-
-            is_valid = is_valid_sql(clean_sql_for_execution(str(txt2sql)), question["db_id"])
-
-            all_responses.append({
-                "question_id": question["question_id"],
-                "db_id": question["db_id"],
-                "question": question["question"],
-                "true_sql": question["SQL"],
-                "text_2_sql": txt2sql,
-                "prompt": prompt,
-                "attempt": _ + 1,
-                "is_valid": is_valid,
-                "difficulty": question["difficulty"]
-            })
-
-            # Validate the SQL query
-            if is_valid:
-                break
-
-            else:
-                print(
-                    f"[LLM] Invalid SQL generated for question_id={question['question_id']}, current attempt: {_ + 1}, retrying...")
+# Sampling parameters of every text-to-SQL generation
+GENERATION_PARAMS = {
+    "temperature": 0.1,
+    "max_tokens": 1024,
+    "top_k": 2,
+    "top_p": 0.9,
+}
+
+
+def build_question_schema(question: dict, schema_pruning_radius: int = None) -> str:
+    """
+    Renders the schema part of a question's prompt.
+
+    When schema_pruning_radius is set, it only includes the tables named in the
+    question's token_column_mapping and their foreign key neighbours up to that many hops.
+    """
+    tables = None
+    if schema_pruning_radius is not None:
+        tables = prune_tables(question["db_id"], question["token_column_mapping"], radius=schema_pruning_radius)
+    return generate_schema_prompt(question["db_id"], tables)
+
+
+def build_question_prompt(question: dict, schema_pruning_radius: int = None, schema_prompt: str = None) -> str:
+    """
+    Builds the text-to-SQL prompt of a question, reusing schema_prompt if given
+    (see build_question_schema for schema_pruning_radius).
+    """
+    # Create a combined prompt for schema alignment.
+    # We can embed db_id, question text, and any evidence or knowledge
+    if schema_prompt is None:
+        schema_prompt = build_question_schema(question, schema_pruning_radius)
+
+    return generate_combined_prompts(
+        db_path=question["db_id"],
+        question=question["question"],
+        sql_dialect='PostgreSQL',
+        knowledge=question["token_column_mapping"],
+        schema_prompt=schema_prompt,
+    )
+
+
+def build_repair_prompt(question: dict, schema_prompt: str, failed_sql: str, error: str) -> str:
+    """
+    Builds the prompt asking to fix failed_sql, given the error the database returned for it.
+    """
+    return generate_repair_prompt(
+        schema_prompt=schema_prompt,
+        question=question["question"],
+        sql_dialect='PostgreSQL',
+        failed_sql=failed_sql,
+        error=error,
+        knowledge=question["token_column_mapping"],
+    )
+
+
+def make_record(question: dict, txt2sql, prompt: str, attempt: int, is_valid: bool) -> dict:
+    return {
+        "question_id": question["question_id"],
+        "db_id": question["db_id"],
+        "question": question["question"],
+        "true_sql": question["SQL"],
+        "text_2_sql": txt2sql,
+        "prompt": prompt,
+        "attempt": attempt,
+        "is_valid": is_valid,
+        "difficulty": question["difficulty"]
+    }
+
+
+@timed("process_question", label=lambda question, *args, **kwargs: question["db_id"])
+def process_question(question: dict, model_id: str, generation_retries: int = 3,
+                     schema_pruning_radius: int = None, repair_prompts: bool = True) -> list:
+    """
+    Generate SQL for a single question, retrying up to generation_retries
+    times until the generated query is valid. Returns one record per attempt,
+    each with the prompt it was generated from.
+    See build_question_schema for schema_pruning_radius.
+
+    With repair_prompts, a retry sends a repair prompt quoting the failed SQL and the
+    validation error, built on the same rendered schema; otherwise the original
+    prompt is sent again.
+    """
+    schema_prompt = build_question_schema(question, schema_pruning_radius)
+    prompt = build_question_prompt(question, schema_prompt=schema_prompt)
+
+    responses = []
+    sent_prompts = set()
+
+    # check if the SQL query is valid for generation_retries and retry if not
+    for _ in range(generation_retries):
+        # Call the LLM model
+        # A prompt sent again must not replay the cached completion
+        txt2sql = call_llm_model({
+            "prompt": prompt,
+            **GENERATION_PARAMS,
+        }, model_id=model_id, bypass_cache=prompt in sent_prompts)
+        sent_prompts.add(prompt)
+
+        sql = clean_sql_for_execution(str(txt2sql))
+        is_valid, error = validate_sql(sql, question["db_id"])
+
+        responses.append(make_record(question, txt2sql, prompt, _ + 1, is_valid))
+
+        # Validate the SQL query
+        if is_valid:
+            break
+
         else:
+            increment("process_question.invalid_attempts", label=question["db_id"])
             print(
-                f"[LLM] Failed to generate valid SQL for question_id={question['question_id']} after {generation_retries} retries.")
+                f"[LLM] Invalid SQL generated for question_id={question['question_id']}, current attempt: {_ + 1}, retrying...")
+            if repair_prompts:
+                prompt = build_repair_prompt(question, schema_prompt, sql, error)
+    else:
+        print(
+            f"[LLM] Failed to generate valid SQL for question_id={question['question_id']} after {generation_retries} retries.")
+
+    return responses
+
+
+@timed("process_question", label=lambda question, *args, **kwargs: question["db_id"])
+def process_question_speculative(question: dict, model_id: str, candidates: int = 3, temperatures: list = None,
+                                 selection: str = "first_valid", schema_pruning_radius: int = None) -> list:
+    """
+    Generate SQL for a single question with candidates concurrent generations,
+    validated in parallel, instead of sequential retries.
+
+    Candidate i is sampled at temperatures[i] (default: the GENERATION_PARAMS temperature).
+    Every candidate has its own completion cache entry (the first one shares the entry
+    of process_question's first attempt), so a re-run replays all of them. Cached
+    candidates are validated before any model call: with selection="first_valid" a
+    valid cached candidate is kept without firing the others, otherwise the cached
+    candidates take part in the selection and only the missing ones are generated.
+
+    With selection="first_valid" the first candidate found valid is kept and the
+    remaining ones are abandoned: candidates that have not reached the LLM yet are
+    skipped and in-flight ones are not validated. With selection="vote" every
+    candidate is completed and the valid one whose result set is shared by most
+    valid candidates is kept (ties go to the lowest candidate index).
+
+    Returns one record per finished invalid candidate, then the kept candidate,
+    all with attempt set to the candidate index + 1; other valid candidates are
+    dropped, so every question still has at most one valid record.
+    """
+    prompt = build_question_prompt(question, schema_pruning_radius)
+    temperatures = temperatures or [GENERATION_PARAMS["temperature"]] * candidates
+    stop = threading.Event()
+
+    def request(idx):
+        return {
+            "prompt": prompt,
+            **GENERATION_PARAMS,
+            "temperature": temperatures[idx % len(temperatures)],
+        }
+
+    def cache_variant(idx):
+        return None if idx == 0 else f"candidate-{idx}"
+
+    def check(idx, txt2sql):
+        sql = clean_sql_for_execution(str(txt2sql))
+        is_valid = is_valid_sql(sql, question["db_id"])
+        fingerprint = query_result_fingerprint(sql, question["db_id"]) if is_valid and selection == "vote" else None
+        return idx, txt2sql, is_valid, fingerprint
+
+    def generate(idx):
+        if stop.is_set():
+            return None
+        txt2sql = call_llm_model(request(idx), model_id=model_id, cache_variant=cache_variant(idx))
+        if stop.is_set():
+            return None
+        return check(idx, txt2sql)
+
+    # Cached candidates cost no model call: validate them first
+    finished = []
+    uncached = []
+    for idx in range(candidates):
+        txt2sql = None if stop.is_set() else cached_completion(request(idx), model_id, cache_variant(idx))
+        if txt2sql is None:
+            uncached.append(idx)
             continue
+        result = check(idx, txt2sql)
+        finished.append(result)
+        if result[2] and selection == "first_valid":
+            stop.set()
+
+    if uncached and not stop.is_set():
+        executor = ThreadPoolExecutor(max_workers=len(uncached))
+        try:
+            for future in as_completed([executor.submit(generate, idx) for idx in uncached]):
+                result = future.result()
+                if result is None:
+                    continue
+                finished.append(result)
+                if result[2] and selection == "first_valid":
+                    stop.set()
+                    break
+        finally:
+            # In-flight LLM calls cannot be interrupted; they finish in the background and are discarded
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    valid = sorted(result for result in finished if result[2])
+    kept = None
+    if valid:
+        votes = Counter(result[3] for result in valid if result[3] is not None)
+        if votes:
+            best = max(votes.values())
+            kept = next(result for result in valid if result[3] is not None and votes[result[3]] == best)
+        else:
+            kept = valid[0]
+
+    responses = []
+    for idx, txt2sql, is_valid, _ in sorted(finished):
+        if not is_valid:
+            increment("process_question.invalid_attempts", label=question["db_id"])
+            responses.append(make_record(question, txt2sql, prompt, idx + 1, False))
+    if kept is not None:
+        responses.append(make_record(question, kept[1], prompt, kept[0] + 1, True))
+    else:
+        print(
+            f"[LLM] Failed to generate valid SQL for question_id={question['question_id']} with {candidates} candidates.")
+
+    return responses
+
 
-        print(f"[LLM] Processed question_id={question['question_id']}, progress={len(all_responses)}/{len(questions)}")
+def iter_llm_responses(questions, model_id: str, generation_retries: int = 3, max_workers: int = 1,
+                       max_in_flight: int = None, journal: Journal = None, schema_pruning_radius: int = None,
+                       candidates: int = 1, candidate_temperatures: list = None,
+                       candidate_selection: str = "first_valid", repair_prompts: bool = True):
+    """
+    Yields the records of every attempt for each question, following the question order.
 
-    # 4. Write all responses to a single JSON file
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(all_responses, f, ensure_ascii=False, indent=2)
+    questions can be any iterable (e.g. a stream from read_records) and is consumed lazily,
+    so downstream stages can consume the records while generation is still running.
+    Questions already completed in journal are replayed from it instead of calling the LLM;
+    newly completed questions are appended to it as soon as they finish.
+    With candidates > 1 each question uses process_question_speculative instead of sequential retries.
+    """
+    completed = journal.load() if journal is not None else {}
+    if completed:
+        print(f"[LLM] Resuming from {journal.path}: {len(completed)} questions already completed")
+
+    def process(question):
+        if question["question_id"] in completed:
+            return question, completed[question["question_id"]], True
+        if candidates > 1:
+            responses = process_question_speculative(question, model_id, candidates, candidate_temperatures,
+                                                     candidate_selection, schema_pruning_radius)
+        else:
+            responses = process_question(question, model_id, generation_retries, schema_pruning_radius,
+                                         repair_prompts)
+        if journal is not None:
+            journal.append(question["question_id"], responses)
+        return question, responses, False
+
+    results = ordered_map(process, questions, max_workers=max_workers, max_in_flight=max_in_flight)
+    for idx, (question, responses, resumed) in enumerate(results):
+        if not resumed:
+            print(f"[LLM] Processed question_id={question['question_id']}, progress={idx + 1}")
+        yield from responses
+
+
+def stream_llm_process(input_file: str, model_id: str, generation_retries: int = 3,
+                       max_workers: int = 1, max_in_flight: int = None, journal_file: str = None,
+                       schema_pruning_radius: int = None, candidates: int = 1, candidate_temperatures: list = None,
+                       candidate_selection: str = "first_valid", repair_prompts: bool = True):
+    """
+    Returns a generator of the records of every attempt for each question of input_file,
+    without writing them anywhere, so the next stage can consume them as they are produced.
+    Arguments are those of run_llm_process.
+    """
+    journal = None
+    if journal_file:
+        signature = stage_signature([input_file], {
+            "model_id": model_id,
+            "generation_retries": generation_retries,
+            "schema_pruning_radius": schema_pruning_radius,
+            "schema_provider": type(get_schema_provider()).__name__,
+            "candidates": candidates,
+            "candidate_temperatures": candidate_temperatures,
+            "candidate_selection": candidate_selection,
+            "repair_prompts": repair_prompts,
+        })
+        journal = Journal(journal_file, signature)
+
+    return iter_llm_responses(
+        read_records(input_file), model_id, generation_retries,
+        max_workers=max_workers, max_in_flight=max_in_flight, journal=journal,
+        schema_pruning_radius=schema_pruning_radius, candidates=candidates,
+        candidate_temperatures=candidate_temperatures, candidate_selection=candidate_selection,
+        repair_prompts=repair_prompts,
+    )
+
+
+def run_llm_process(input_file: str, output_file: str, model_id: str, generation_retries: int = 3,
+                    max_workers: int = 1, max_in_flight: int = None, journal_file: str = None,
+                    schema_pruning_radius: int = None, candidates: int = 1, candidate_temperatures: list = None,
+                    candidate_selection: str = "first_valid", repair_prompts: bool = True):
+    """
+    Generate SQL for every question of input_file and save all attempts to output_file.
+
+    With max_workers > 1 the questions are processed concurrently by a thread pool,
+    with at most max_in_flight questions submitted at a time. Each question keeps its
+    own sequential retry loop, and the output follows the input question order
+    regardless of completion order.
+
+    When journal_file is set, the records of every completed question are appended to
+    it as soon as the question finishes, and questions already in the journal are not
+    sent to the LLM again, so an interrupted run resumes where it stopped.
+
+    schema_pruning_radius enables schema pruning (see process_question); None keeps every table.
+
+    With candidates > 1, every question fires that many concurrent generations (sampled at
+    candidate_temperatures, if given) instead of up to generation_retries sequential ones, and
+    keeps the first valid candidate or, with candidate_selection="vote", the majority result
+    (see process_question_speculative). A hard question then costs about one round-trip.
+
+    repair_prompts makes sequential retries send the validation error back to the model
+    (see process_question).
+
+    Questions are streamed from input_file (JSONL or legacy JSON array) and the records
+    are streamed to output_file as they are produced when it is a .jsonl file.
+    """
+    responses = stream_llm_process(
+        input_file, model_id, generation_retries, max_workers=max_workers, max_in_flight=max_in_flight,
+        journal_file=journal_file, schema_pruning_radius=schema_pruning_radius, candidates=candidates,
+        candidate_temperatures=candidate_temperatures, candidate_selection=candidate_selection,
+        repair_prompts=repair_prompts,
+    )
+    write_records(output_file, responses)
 
     print(f"[LLM] All responses saved to {output_file}")
+    print(f"[LLM] Rate limiter stats: {get_rate_limiter(model_id).stats()}")
+    print(f"[LLM] Token usage: {token_usage_stats().get(model_id)}")
 
 
 if __name__ == "__main__":
@@ -96,6 +374,68 @@ if __name__ == "__main__":
         default="your-bedrock-model-id",
         help="Bedrock model ID or ARN."
     )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=1,
+        help="Number of questions processed concurrently."
+    )
+    parser.add_argument(
+        "--max_in_flight",
+        type=int,
+        default=None,
+        help="Maximum number of questions submitted at a time (defaults to 2 * max_workers)."
+    )
+    parser.add_argument(
+        "--journal_file",
+        type=str,
+        default=None,
+        help="Path of the JSONL journal used to resume an interrupted run."
+    )
+    parser.add_argument(
+        "--schema_pruning_radius",
+        type=int,
+        default=None,
+        help="Keep only mapped tables and their foreign key neighbours up to this many hops."
+    )
+    parser.add_argument(
+        "--schema_source",
+        type=str,
+        default="postgres",
+        choices=["postgres", "tables_json"],
+        help="Build prompt schemas from the live database or from the tables JSON (TABLES_FILE)."
+    )
+    parser.add_argument(
+        "--candidates",
+        type=int,
+        default=1,
+        help="Concurrent candidate generations per question (1 keeps sequential retries)."
+    )
+    parser.add_argument(
+        "--candidate_temperatures",
+        type=float,
+        nargs="+",
+        default=None,
+        help="Sampling temperature of each candidate."
+    )
+    parser.add_argument(
+        "--candidate_selection",
+        type=str,
+        default="first_valid",
+        choices=["first_valid", "vote"],
+        help="Keep the first valid candidate or the majority result set."
+    )
+    parser.add_argument(
+        "--no_repair_prompts",
+        action="store_true",
+        help="Resend the original prompt on retries instead of a repair prompt with the validation error."
+    )
     args = parser.parse_args()
 
-    run_llm_process(args.input_file, args.output_file, args.model_id)
+    set_schema_provider(create_schema_provider(args.schema_source))
+
+    run_llm_process(args.input_file, args.output_file, args.model_id,
+                    max_workers=args.max_workers, max_in_flight=args.max_in_flight,
+                    journal_file=args.journal_file, schema_pruning_radius=args.schema_pruning_radius,
+                    candidates=args.candidates, candidate_temperatures=args.candidate_temperatures,
+                    candidate_selection=args.candidate_selection, repair_prompts=not args.no_repair_prompts)
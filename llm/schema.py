@@ -0,0 +1,269 @@
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from pgdb.pg_utils import (
+    get_connection,
+    db_table_map,
+    format_postgresql_create_table,
+    fetch_table_columns,
+    catalog_fingerprint,
+)
+
+# Tables JSON of the BIRD split (table names, columns, types and keys per db_id)
+TABLES_FILE = os.getenv("TABLES_FILE", str(Path(__file__).resolve().parent.parent / "data" / "dev_tables.json"))
+# Where prompt schemas come from: "postgres" (live catalog) or "tables_json" (TABLES_FILE, no database needed)
+SCHEMA_SOURCE = os.getenv("SCHEMA_SOURCE", "postgres")
+# Optional JSON file persisting the schemas rendered from the live catalog across runs
+SCHEMA_CACHE_FILE = os.getenv("SCHEMA_CACHE_FILE")
+
+# tables file path -> {db_id: tables entry}
+_tables_metadata = {}
+_tables_metadata_lock = threading.Lock()
+
+
+def load_tables_metadata(tables_file: str = TABLES_FILE) -> dict:
+    """
+    Returns the tables JSON as a dict keyed by db_id, loaded once per process.
+    """
+    with _tables_metadata_lock:
+        if tables_file not in _tables_metadata:
+            with open(tables_file, "r", encoding="utf-8") as f:
+                _tables_metadata[tables_file] = {entry["db_id"]: entry for entry in json.load(f)}
+        return _tables_metadata[tables_file]
+
+
+def foreign_key_graph(db_id: str, tables_file: str = TABLES_FILE) -> dict:
+    """
+    Returns the undirected foreign key graph of db_id as a dict of
+    lowercase table name -> set of lowercase neighbour table names.
+    """
+    entry = load_tables_metadata(tables_file)[db_id]
+    table_names = [name.lower() for name in entry["table_names_original"]]
+    column_tables = [table_idx for table_idx, _ in entry["column_names_original"]]
+
+    graph = {name: set() for name in table_names}
+    for column_idx, referenced_idx in entry["foreign_keys"]:
+        table = table_names[column_tables[column_idx]]
+        referenced = table_names[column_tables[referenced_idx]]
+        if table != referenced:
+            graph[table].add(referenced)
+            graph[referenced].add(table)
+    return graph
+
+
+def prune_tables(db_id: str, token_column_mapping, radius: int = 1, tables_file: str = TABLES_FILE):
+    """
+    Returns the tables of db_id to keep in the prompt: the tables named in
+    token_column_mapping plus their foreign key neighbours up to radius hops,
+    in db_table_map order.
+
+    Returns None (keep the whole schema) when the mapping names no known table.
+    """
+    all_tables = db_table_map[db_id]
+    known = {table.lower() for table in all_tables}
+
+    mapped = set()
+    if isinstance(token_column_mapping, dict):
+        for mapping in token_column_mapping.values():
+            if isinstance(mapping, dict) and isinstance(mapping.get("table_name"), str):
+                mapped.add(mapping["table_name"].lower())
+    mapped &= known
+    if not mapped:
+        return None
+
+    graph = foreign_key_graph(db_id, tables_file)
+    selected = set(mapped)
+    frontier = set(mapped)
+    for _ in range(radius):
+        frontier = {neighbour for table in frontier for neighbour in graph.get(table, ())} - selected
+        selected |= frontier
+
+    return [table for table in all_tables if table.lower() in selected]
+
+
+class SchemaProvider(ABC):
+    """
+    Source of the CREATE TABLE statements used in the prompts.
+    """
+
+    @abstractmethod
+    def table_schemas(self, db_id: str) -> dict:
+        """
+        Returns a dict mapping every table of db_id to its CREATE TABLE statement.
+        """
+
+    def invalidate(self, db_id: str = None):
+        """
+        Drops any cached schema of db_id (or of every database when None).
+        """
+
+
+def _read_schema_cache_file(cache_file):
+    if not cache_file or not os.path.exists(cache_file):
+        return {}
+    with open(cache_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_schema_cache_file(cache_file, content):
+    if os.path.dirname(cache_file):
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = f"{cache_file}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(content, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, cache_file)
+
+
+class PostgresSchemaProvider(SchemaProvider):
+    """
+    Builds the schemas from the live PostgreSQL catalog.
+
+    Schemas are built once per database with a single catalog query and memoized
+    in-process. When cache_file is set they are also persisted to disk together
+    with a catalog fingerprint; a persisted entry is reused only while the
+    fingerprint still matches, so any change to the tables invalidates it.
+    """
+
+    def __init__(self, cache_file: str = SCHEMA_CACHE_FILE):
+        self.cache_file = cache_file
+        self._schemas = {}
+        self._lock = threading.Lock()
+
+    def table_schemas(self, db_id: str) -> dict:
+        with self._lock:
+            if db_id in self._schemas:
+                return self._schemas[db_id]
+
+            tables = db_table_map[db_id]
+            with get_connection() as db:
+                cursor = db.cursor()
+                fingerprint = None
+                if self.cache_file:
+                    fingerprint = catalog_fingerprint(cursor, tables)
+                    cached = _read_schema_cache_file(self.cache_file).get(db_id)
+                    if cached and cached["fingerprint"] == fingerprint:
+                        self._schemas[db_id] = cached["tables"]
+                        return cached["tables"]
+
+                columns = fetch_table_columns(cursor, tables)
+
+            schemas = {table: format_postgresql_create_table(table, columns[table]) for table in tables}
+            self._schemas[db_id] = schemas
+
+            if self.cache_file:
+                content = _read_schema_cache_file(self.cache_file)
+                content[db_id] = {"fingerprint": fingerprint, "tables": schemas}
+                _write_schema_cache_file(self.cache_file, content)
+
+            return schemas
+
+    def invalidate(self, db_id: str = None):
+        with self._lock:
+            if db_id is None:
+                self._schemas.clear()
+            else:
+                self._schemas.pop(db_id, None)
+
+            if self.cache_file and os.path.exists(self.cache_file):
+                content = {} if db_id is None else _read_schema_cache_file(self.cache_file)
+                content.pop(db_id, None)
+                _write_schema_cache_file(self.cache_file, content)
+
+
+class TablesJsonSchemaProvider(SchemaProvider):
+    """
+    Builds the schemas, including primary and foreign keys, from a BIRD tables
+    JSON file, so prompts can be generated without database access.
+    All schemas of the file are rendered once, when the provider is created.
+    """
+
+    def __init__(self, tables_file: str = TABLES_FILE):
+        self.tables_file = tables_file
+        self._schemas = {
+            db_id: self._render(db_id, entry)
+            for db_id, entry in load_tables_metadata(tables_file).items()
+        }
+
+    @staticmethod
+    def _render(db_id: str, entry: dict) -> dict:
+        table_names = entry["table_names_original"]
+        column_names = entry["column_names_original"]
+        column_types = entry["column_types"]
+
+        # Primary keys may be a single column index or a list of indexes (composite key)
+        primary_keys = {}
+        primary_key_columns = set()
+        for key in entry["primary_keys"]:
+            key_columns = [column_names[idx] for idx in (key if isinstance(key, list) else [key])]
+            primary_keys[key_columns[0][0]] = [column for _, column in key_columns]
+            primary_key_columns.update((table_idx, column) for table_idx, column in key_columns)
+
+        foreign_keys = {}
+        for column_idx, referenced_idx in entry["foreign_keys"]:
+            table_idx, column = column_names[column_idx]
+            referenced_table_idx, referenced_column = column_names[referenced_idx]
+            foreign_keys.setdefault(table_idx, []).append(
+                (column, table_names[referenced_table_idx], referenced_column)
+            )
+
+        # Same tables and order as the live database when the db_id is known
+        tables = db_table_map.get(db_id, table_names)
+        table_index = {name.lower(): idx for idx, name in enumerate(table_names)}
+
+        schemas = {}
+        for table in tables:
+            table_idx = table_index.get(table.lower())
+            if table_idx is None:
+                continue
+            columns_info = [
+                (column, column_type, "NO" if (table_idx, column) in primary_key_columns else None)
+                for (column_table_idx, column), column_type in zip(column_names, column_types)
+                if column_table_idx == table_idx
+            ]
+            schemas[table] = format_postgresql_create_table(
+                table,
+                columns_info,
+                primary_keys=primary_keys.get(table_idx),
+                foreign_keys=foreign_keys.get(table_idx),
+            )
+        return schemas
+
+    def table_schemas(self, db_id: str) -> dict:
+        return self._schemas[db_id]
+
+
+_schema_provider = None
+_schema_provider_lock = threading.Lock()
+
+
+def set_schema_provider(provider: SchemaProvider = None):
+    """
+    Sets the schema provider used to build prompts; None restores the SCHEMA_SOURCE default.
+    """
+    global _schema_provider
+    with _schema_provider_lock:
+        _schema_provider = provider
+
+
+def get_schema_provider() -> SchemaProvider:
+    """
+    Returns the current schema provider, creating the SCHEMA_SOURCE default on first use.
+    """
+    global _schema_provider
+    with _schema_provider_lock:
+        if _schema_provider is None:
+            _schema_provider = create_schema_provider(SCHEMA_SOURCE)
+        return _schema_provider
+
+
+def create_schema_provider(source: str) -> SchemaProvider:
+    match source:
+        case "postgres":
+            return PostgresSchemaProvider()
+        case "tables_json":
+            return TablesJsonSchemaProvider()
+        case _:
+            raise ValueError(f"Schema source '{source}' not recognized.")
@@ -1,6 +1,46 @@
-from typing import Set, Tuple
+import hashlib
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Optional, Set, Tuple
 
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+from pipeline.metrics import timed
+
+# Connection settings shared by connect_postgresql and the connection pool
+PG_CONFIG = {
+    "dbname": "BIRD",
+    "user": "postgres",
+    "host": "localhost",
+    "password": "postgres",
+    "port": "5432",
+}
+PG_POOL_MINCONN = int(os.getenv("PG_POOL_MINCONN", "1"))
+PG_POOL_MAXCONN = int(os.getenv("PG_POOL_MAXCONN", "16"))
+
+# How is_valid_sql checks a query: "plan" only parses and plans it with EXPLAIN,
+# "execute" runs it to completion
+PG_VALIDATION_MODE = os.getenv("PG_VALIDATION_MODE", "plan")
+PG_VALIDATION_TIMEOUT_MS = int(os.getenv("PG_VALIDATION_TIMEOUT_MS", "5000"))
+
+# Explicit data version of the databases (e.g. a dataset release), part of the
+# database_fingerprint; bump it whenever the data is reloaded
+GOLD_DATA_VERSION = os.getenv("GOLD_DATA_VERSION", "bird-dev")
+# Also checksum every row of every table in database_fingerprint (a full scan of
+# each database, opt-in), so data changes are detected without bumping the version
+GOLD_ROW_CHECKSUM = os.getenv("GOLD_ROW_CHECKSUM", "false").lower() in ("1", "true", "yes")
+
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+
+# db_id -> tables of db_table_map missing from the database
+_missing_tables_cache = {}
 
 db_table_map = {
     "debit_card_specializing": [
@@ -117,7 +157,8 @@ def nice_look_table(column_names: list, values: list) -> str:
     return final_output
 
 
-def format_postgresql_create_table(table_name: str, columns_info: list) -> str:
+def format_postgresql_create_table(table_name: str, columns_info: list, primary_keys: list = None,
+                                   foreign_keys: list = None) -> str:
     """
     Given a table name and a list of columns_info,
     returns a valid PostgreSQL CREATE TABLE statement.
@@ -125,57 +166,188 @@ def format_postgresql_create_table(table_name: str, columns_info: list) -> str:
     columns_info should be a list of tuples/lists in the form:
       (column_name, data_type, is_nullable)
     For example: ("customerid", "bigint", "YES")
+    is_nullable may be None when unknown, in which case no NULL constraint is written.
+
+    Optionally, primary_keys lists the primary key columns and foreign_keys lists
+    (column_name, referenced_table, referenced_column) tuples.
     """
     lines = [f"CREATE TABLE {table_name}\n("]
-    for i, (column_name, data_type, is_nullable) in enumerate(columns_info):
-        null_status = "NULL" if is_nullable.upper() == "YES" else "NOT NULL"
+    entries = []
+    for column_name, data_type, is_nullable in columns_info:
         postgres_data_type = data_type.upper()
-        column_line = f"    `{column_name}` {postgres_data_type} {null_status}"
-        if i < len(columns_info) - 1:
-            column_line += ","
-        lines.append(column_line)
+        column_line = f"    `{column_name}` {postgres_data_type}"
+        if is_nullable is not None:
+            null_status = "NULL" if is_nullable.upper() == "YES" else "NOT NULL"
+            column_line += f" {null_status}"
+        entries.append(column_line)
+
+    if primary_keys:
+        entries.append(f"    PRIMARY KEY ({', '.join(f'`{column}`' for column in primary_keys)})")
+    for column_name, referenced_table, referenced_column in foreign_keys or []:
+        entries.append(f"    FOREIGN KEY (`{column_name}`) REFERENCES {referenced_table} (`{referenced_column}`)")
 
+    if entries:
+        lines.append(",\n".join(entries))
     lines.append(");")
     return "\n".join(lines)
 
 
-def is_valid_sql(query: str, db_id: str) -> bool:
+def fetch_table_columns(cursor, tables: list) -> dict:
     """
-    Check if the SQL query is valid for the given database ID.
-    This function assumes that the database connection is already established.
+    Fetch (column_name, data_type, is_nullable) for all the given tables
+    with a single information_schema query.
+    Returns a dict mapping each table name to its list of columns, in column order.
     """
-    db = connect_postgresql()
-    cursor = db.cursor()
+    cursor.execute(
+        """
+            SELECT table_name, column_name, data_type, is_nullable
+            FROM information_schema.columns
+            WHERE table_name = ANY(%s)
+            ORDER BY table_name, ordinal_position;
+        """,
+        (list(tables),)
+    )
+    columns = {table: [] for table in tables}
+    for table_name, column_name, data_type, is_nullable in cursor.fetchall():
+        columns[table_name].append((column_name, data_type, is_nullable))
+    return columns
+
+
+def catalog_fingerprint(cursor, tables: list) -> str:
+    """
+    Returns a hash of the catalog definition (column names, types and nullability)
+    of the given tables. It changes whenever one of the tables is created, dropped
+    or altered, and is much cheaper to compute than querying information_schema.
+    """
+    cursor.execute(
+        """
+            SELECT md5(COALESCE(string_agg(
+                c.relname || '.' || a.attname || ':' || a.atttypid || ':' || a.atttypmod || ':' || a.attnotnull,
+                ',' ORDER BY c.relname, a.attnum
+            ), ''))
+            FROM pg_class c
+            JOIN pg_attribute a ON a.attrelid = c.oid
+            WHERE c.relname = ANY(%s) AND a.attnum > 0 AND NOT a.attisdropped;
+        """,
+        (list(tables),)
+    )
+    return cursor.fetchone()[0]
+
+
+def table_checksum(cursor, tables: list) -> str:
+    """
+    Returns a hash of the rows of the given tables, resolved through the search_path:
+    each table is summarized by its row count and the sum of the md5 hashes of its
+    rows, which does not depend on the physical row order. Missing tables are skipped.
+    This scans every table, so it is meant to be computed once per database.
+    """
+    cursor.execute(
+        "SELECT t, to_regclass(t)::text FROM unnest(%s::text[]) AS t;",
+        (list(tables),)
+    )
+    relations = [(table, relation) for table, relation in cursor.fetchall() if relation]
+    if not relations:
+        return hashlib.md5(b"").hexdigest()
+
+    # regclass::text is already quoted and schema-qualified where needed
+    cursor.execute(
+        " UNION ALL ".join(
+            f"SELECT %s, count(*), COALESCE(sum(('x' || substr(md5(r::text), 1, 16))::bit(64)::bigint), 0) "
+            f"FROM {relation} r"
+            for _, relation in relations
+        ) + ";",
+        [table for table, _ in relations]
+    )
+    checksums = sorted(f"{table}:{count}:{digest}" for table, count, digest in cursor.fetchall())
+    return hashlib.md5(",".join(checksums).encode("utf-8")).hexdigest()
 
+
+def database_fingerprint(cursor, db_id: str, data_version: str = GOLD_DATA_VERSION,
+                         row_checksum: bool = GOLD_ROW_CHECKSUM) -> str:
+    """
+    Returns a string identifying the schema and data version of db_id: the catalog
+    fingerprint of its tables combined with data_version (e.g. a dataset release)
+    and, when row_checksum is set, with the checksum of all their rows.
+
+    Only the catalog query runs by default; the row checksum scans every table.
+    """
+    tables = db_table_map.get(db_id, [])
+    parts = [data_version or ""]
+    if row_checksum:
+        parts.append(table_checksum(cursor, tables))
+    return "-".join([catalog_fingerprint(cursor, tables), *parts])
+
+
+def find_missing_tables(cursor, db_id: str) -> list:
+    """
+    Returns the tables of db_id that do not exist in the database, using a
+    single catalog query whose result is cached per db_id.
+    """
+    if db_id not in _missing_tables_cache:
+        cursor.execute(
+            "SELECT t FROM unnest(%s::text[]) AS t WHERE to_regclass(t) IS NULL;",
+            (db_table_map.get(db_id, []),)
+        )
+        _missing_tables_cache[db_id] = [row[0] for row in cursor.fetchall()]
+    return _missing_tables_cache[db_id]
+
+
+@timed("validate_sql", label=lambda query, db_id, *args, **kwargs: db_id)
+def validate_sql(query: str, db_id: str, mode: str = PG_VALIDATION_MODE,
+                 statement_timeout_ms: int = PG_VALIDATION_TIMEOUT_MS) -> Tuple[bool, Optional[str]]:
+    """
+    Check if the SQL query is valid for the given database ID.
+    Returns (True, None) for a valid query, or (False, error message) otherwise.
+
+    The check runs in a read-only transaction with a statement timeout, on a pooled
+    connection with the search_path set to db_id. With mode="plan" the query is only
+    parsed and planned (EXPLAIN without ANALYZE), so its cost is the planning time;
+    mode="execute" runs the query to completion.
+    """
     # Get the table names for the given db_id
     tables = db_table_map.get(db_id, [])
     if not tables:
         print(f"No tables found for db_id: {db_id}")
-        return False
+        return False, f"No tables found for db_id: {db_id}"
 
-    # Check if all tables in the query exist in the database
-    for table in tables:
-        cursor.execute(f"SELECT to_regclass('{table}')")
-        result = cursor.fetchone()
-        if result[0] is None:
-            print(f"Table {table} does not exist in the database.")
-            return False
+    with get_connection(db_id) as db:
+        cursor = db.cursor()
+        cursor.execute("SET TRANSACTION READ ONLY;")
+        cursor.execute("SET LOCAL statement_timeout = %s;", (statement_timeout_ms,))
 
-    # Execute the SQL query to check its validity
-    try:
-        cursor.execute(query)
-        return True
-    except Exception as err:
-        print(f"SQL query execution failed: {err}")
-        return False
+        # Check if all tables in the query exist in the database
+        missing_tables = find_missing_tables(cursor, db_id)
+        if missing_tables:
+            print(f"Tables {missing_tables} do not exist in the database.")
+            return False, f"Tables {missing_tables} do not exist in the database."
+
+        # Plan (or execute) the SQL query to check its validity
+        try:
+            cursor.execute(f"EXPLAIN {query}" if mode == "plan" else query)
+            return True, None
+        except Exception as err:
+            print(f"SQL query validation failed: {err}")
+            return False, str(err).strip()
+
+
+def is_valid_sql(query: str, db_id: str, mode: str = PG_VALIDATION_MODE,
+                 statement_timeout_ms: int = PG_VALIDATION_TIMEOUT_MS) -> bool:
+    """
+    Check if the SQL query is valid for the given database ID (see validate_sql).
+    """
+    return validate_sql(query, db_id, mode, statement_timeout_ms)[0]
 
 
-def execute_query_and_get_rows(sql_query: str, cursor) -> Set[Tuple]:
+@timed("execute_query_and_get_rows")
+def execute_query_and_get_rows(sql_query: str, cursor, statement_timeout_ms: int = None) -> Set[Tuple]:
     """
     Execute a SQL query and return the result as a set of tuples
     for row-level comparison.
+    When statement_timeout_ms is set, the query is cancelled after that many milliseconds.
     """
     try:
+        if statement_timeout_ms:
+            cursor.execute("SET LOCAL statement_timeout = %s;", (statement_timeout_ms,))
         cursor.execute(sql_query)
         rows = cursor.fetchall()
 
@@ -183,24 +355,202 @@ def execute_query_and_get_rows(sql_query: str, cursor) -> Set[Tuple]:
         row_set = {tuple(row) for row in rows}
     except Exception as err:
         print(f"Failed to execute query: {sql_query}")
+        # Leave the connection usable for the next query
+        cursor.connection.rollback()
         return set()
 
     return row_set
 
 
+def canonical_value(value):
+    """
+    Returns a type-tagged, hashable representation of a result value, so that
+    equal values coming from different column types (e.g. Decimal, float, int)
+    get the same fingerprint while different types of values (e.g. '1' and 1) do not.
+    """
+    if value is None:
+        return ("null",)
+    if isinstance(value, bool):
+        return ("bool", value)
+    if isinstance(value, (int, float, Decimal)):
+        number = float(value)
+        if number != number or number in (float("inf"), float("-inf")):
+            return ("num", str(number))
+        if value == int(value):
+            return ("num", str(int(value)))
+        return ("num", format(number, ".12g"))
+    if isinstance(value, datetime):
+        return ("datetime", value.isoformat())
+    if isinstance(value, date):
+        return ("date", value.isoformat())
+    if isinstance(value, time):
+        return ("time", value.isoformat())
+    if isinstance(value, timedelta):
+        return ("interval", value.total_seconds())
+    if isinstance(value, memoryview):
+        return ("bytes", value.tobytes())
+    return (type(value).__name__, value if isinstance(value, (str, bytes)) else repr(value))
+
+
+def row_fingerprint(row) -> bytes:
+    """
+    Reduces a result row to a compact 8-byte fingerprint of its canonical values.
+    """
+    canonical = repr(tuple(canonical_value(value) for value in row))
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).digest()
+
+
+def stream_query_fingerprints(sql_query: str, db, statement_timeout_ms: int = None, chunk_size: int = 2000,
+                              sample_size: int = 5, max_rows: int = None) -> Optional[dict]:
+    """
+    Execute a SQL query through a server-side cursor and reduce its result to a
+    multiset of row fingerprints, fetching chunk_size rows at a time.
+
+    Returns a dict with the fingerprint Counter, the number of rows read, the first
+    sample_size rows and whether reading stopped early at max_rows, or None if the
+    query failed. Memory is bounded by the number of distinct rows (8 bytes each)
+    and by max_rows, not by the width or total size of the result.
+    """
+    fingerprints = Counter()
+    sample = []
+    count = 0
+    truncated = False
+
+    try:
+        if statement_timeout_ms:
+            with db.cursor() as cursor:
+                cursor.execute("SET LOCAL statement_timeout = %s;", (statement_timeout_ms,))
+
+        with db.cursor(name="row_stream") as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(sql_query.strip().rstrip(";"))
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    if max_rows is not None and count >= max_rows:
+                        truncated = True
+                        break
+                    fingerprints[row_fingerprint(row)] += 1
+                    if len(sample) < sample_size:
+                        sample.append(tuple(row))
+                    count += 1
+                if truncated:
+                    break
+    except Exception as err:
+        print(f"Failed to execute query: {sql_query}")
+        # Leave the connection usable for the next query
+        db.rollback()
+        return None
+
+    return {
+        "fingerprints": fingerprints,
+        "count": count,
+        "sample": sample,
+        "truncated": truncated,
+    }
+
+
+def query_result_fingerprint(query: str, db_id: str, statement_timeout_ms: int = PG_VALIDATION_TIMEOUT_MS,
+                             max_rows: int = 100000) -> Optional[str]:
+    """
+    Runs query read-only on db_id and returns a digest of its result as a multiset
+    of rows (row order ignored), or None if the query failed. Two queries with the
+    same digest returned the same rows.
+    """
+    with get_connection(db_id) as db:
+        with db.cursor() as cursor:
+            cursor.execute("SET TRANSACTION READ ONLY;")
+        result = stream_query_fingerprints(query, db, statement_timeout_ms, sample_size=0, max_rows=max_rows)
+
+    if result is None:
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    for fingerprint, count in sorted(result["fingerprints"].items()):
+        digest.update(fingerprint)
+        digest.update(count.to_bytes(8, "big"))
+    return digest.hexdigest()
+
+
 def connect_postgresql():
     """
-    Establishes a connection to a PostgreSQL database using hardcoded credentials.
+    Establishes a connection to a PostgreSQL database using the PG_CONFIG credentials.
     Returns a psycopg2 connection object.
 
-    Adjust credentials as needed:
-      dbname, user, host, password, port.
+    Prefer get_connection, which hands out pooled connections.
     """
-    db = psycopg2.connect(
-        dbname="BIRD",
-        user="postgres",
-        host="localhost",
-        password="postgres",
-        port="5432"
-    )
+    db = psycopg2.connect(**PG_CONFIG)
     return db
+
+
+def _create_pool(minconn: int, maxconn: int, **config):
+    global _pool, _pool_slots
+    if _pool is not None:
+        _pool.closeall()
+    _pool = ThreadedConnectionPool(minconn, maxconn, **{**PG_CONFIG, **config})
+    # ThreadedConnectionPool raises when exhausted, so callers wait on a semaphore instead
+    _pool_slots = threading.BoundedSemaphore(maxconn)
+
+
+def configure_pool(minconn: int = PG_POOL_MINCONN, maxconn: int = PG_POOL_MAXCONN, **config):
+    """
+    (Re)creates the shared connection pool with the given size.
+    Extra keyword arguments override the PG_CONFIG connection settings.
+    """
+    with _pool_lock:
+        _create_pool(minconn, maxconn, **config)
+
+
+def close_pool():
+    """
+    Closes every connection of the shared pool.
+    """
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = None
+        _pool_slots = None
+
+
+def _get_pool():
+    with _pool_lock:
+        if _pool is None:
+            _create_pool(PG_POOL_MINCONN, PG_POOL_MAXCONN)
+        return _pool, _pool_slots
+
+
+@contextmanager
+def get_connection(db_id: str = None):
+    """
+    Checks out a connection from the shared pool, blocking while all connections are in use.
+
+    When db_id is given, the search_path is set to (db_id, public) once for the checkout.
+    Any open transaction is rolled back when the connection is returned to the pool.
+    """
+    pool, slots = _get_pool()
+    slots.acquire()
+    try:
+        db = pool.getconn()
+        try:
+            cursor = db.cursor()
+            if db_id:
+                cursor.execute(f"SET search_path TO {db_id}, public;")
+            else:
+                cursor.execute("RESET search_path;")
+            # Commit so the search_path survives rollbacks of failed queries
+            db.commit()
+            cursor.close()
+
+            yield db
+        finally:
+            broken = bool(db.closed)
+            if not broken:
+                try:
+                    db.rollback()
+                except psycopg2.Error:
+                    broken = True
+            pool.putconn(db, close=broken)
+    finally:
+        slots.release()
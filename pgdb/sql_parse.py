@@ -0,0 +1,191 @@
+import argparse
+import os
+import time
+from functools import lru_cache
+
+from sql_metadata import Parser
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:  # optional faster parser
+    sqlglot = None
+
+# Parser used to extract tables and columns: "sql_metadata" or "sqlglot". When unset, each
+# of the two uses sqlglot only if it passes the consistency check for it (see default_backend)
+SQL_PARSER_BACKEND = os.getenv("SQL_PARSER_BACKEND")
+SQL_PARSE_CACHE_SIZE = int(os.getenv("SQL_PARSE_CACHE_SIZE", "65536"))
+
+# Query shapes of the BIRD dev set (joins with aliases, quoted columns, subqueries,
+# derived tables, CTEs) on which sqlglot must agree with sql_metadata to be a default
+CONSISTENCY_SAMPLE = [
+    "SELECT COUNT(*) FROM customers WHERE Currency = 'EUR'",
+    "SELECT T1.Diagnosis, T2.Date FROM Patient AS T1 INNER JOIN Laboratory AS T2 ON T1.ID = T2.ID WHERE T1.ID = 30609",
+    "SELECT \"aCL IgA\", \"aCL IgG\" FROM Examination WHERE ID IN (SELECT ID FROM Patient WHERE Diagnosis = 'SLE')",
+    "SELECT T2.driverRef FROM qualifying AS T1 INNER JOIN drivers AS T2 ON T2.driverId = T1.driverId "
+    "WHERE T1.raceId = 20 ORDER BY T1.q1 DESC NULLS LAST LIMIT 1",
+    "SELECT COUNT(UserId) FROM (SELECT UserId, COUNT(Name) AS num FROM badges GROUP BY UserId) AS T WHERE T.num > 5",
+    "WITH totals AS (SELECT CustomerID, SUM(Consumption) AS total FROM yearmonth GROUP BY CustomerID) "
+    "SELECT CustomerID FROM totals ORDER BY total DESC LIMIT 1",
+    "SELECT CAST(SUM(CASE WHEN T2.Age > 65 THEN 1 ELSE 0 END) AS REAL) * 100 / NULLIF(COUNT(T1.Id), 0) "
+    "FROM posts AS T1 INNER JOIN users AS T2 ON T1.OwnerUserId = T2.Id",
+    "SELECT T1.name FROM superhero AS T1 INNER JOIN hero_power AS T2 ON T1.id = T2.hero_id "
+    "INNER JOIN superpower AS T3 ON T2.power_id = T3.id WHERE T3.power_name = 'Agility'",
+]
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Collapses whitespace and drops trailing semicolons, so formatting
+    differences do not produce different cache keys.
+    """
+    return " ".join(sql.split()).rstrip(";").strip()
+
+
+def _unique(names) -> tuple:
+    return tuple(dict.fromkeys(names))
+
+
+def _parse_sql_metadata(sql: str) -> tuple:
+    parser = Parser(sql)
+    return tuple(parser.tables), tuple(parser.columns)
+
+
+def _parse_sqlglot(sql: str) -> tuple:
+    tree = sqlglot.parse_one(sql, read="postgres")
+    cte_names = {cte.alias_or_name for cte in tree.find_all(exp.CTE)}
+
+    tables = []
+    aliases = {}
+    for table in tree.find_all(exp.Table):
+        if table.name in cte_names:
+            continue
+        name = f"{table.db}.{table.name}" if table.db else table.name
+        tables.append(name)
+        aliases[table.alias_or_name] = name
+
+    # Qualify columns with the real table name, as sql_metadata does
+    columns = []
+    for column in tree.find_all(exp.Column):
+        if column.table:
+            columns.append(f"{aliases.get(column.table, column.table)}.{column.name}")
+        else:
+            columns.append(column.name)
+    return _unique(tables), _unique(columns)
+
+
+@lru_cache(maxsize=SQL_PARSE_CACHE_SIZE)
+def _parse(normalized_sql: str, backend: str) -> tuple:
+    match backend:
+        case "sql_metadata":
+            return _parse_sql_metadata(normalized_sql)
+        case "sqlglot":
+            if sqlglot is None:
+                raise ValueError("SQL parser backend 'sqlglot' requires the sqlglot package.")
+            return _parse_sqlglot(normalized_sql)
+        case _:
+            raise ValueError(f"SQL parser backend '{backend}' not recognized.")
+
+
+@lru_cache(maxsize=1)
+def _sample_consistency() -> dict:
+    return check_consistency(CONSISTENCY_SAMPLE, "sqlglot")
+
+
+@lru_cache(maxsize=None)
+def default_backend(kind: str = "tables") -> str:
+    """
+    Returns the backend extracting kind ("tables" or "columns"): SQL_PARSER_BACKEND
+    if set, else "sqlglot" when it is installed and extracts the same kind of names
+    as sql_metadata from every query of CONSISTENCY_SAMPLE, else "sql_metadata".
+    The check runs once, on first use, so the output never silently changes.
+    """
+    if SQL_PARSER_BACKEND:
+        return SQL_PARSER_BACKEND
+    if sqlglot is None:
+        return "sql_metadata"
+
+    report = _sample_consistency()
+    if report["errors"] or report[f"{kind}_agree"] < report["queries"]:
+        print(f"[PARSE] sqlglot agrees with sql_metadata on the {kind} of {report[f'{kind}_agree']}/"
+              f"{report['queries']} sample queries, using sql_metadata for {kind}")
+        return "sql_metadata"
+    return "sqlglot"
+
+
+def extract_tables(sql: str, backend: str = None) -> list:
+    """
+    Returns the tables referenced by sql. Results are memoized by normalized SQL,
+    so repeated queries (e.g. the same gold SQL in several records) are parsed once.
+    Raises if sql cannot be parsed.
+    """
+    return list(_parse(normalize_sql(sql), backend or default_backend("tables"))[0])
+
+
+def extract_columns(sql: str, backend: str = None) -> list:
+    """
+    Returns the columns referenced by sql, qualified with their table name when
+    the query qualifies them (see extract_tables for caching).
+    """
+    return list(_parse(normalize_sql(sql), backend or default_backend("columns"))[1])
+
+
+def parse_cache_info():
+    return _parse.cache_info()
+
+
+def check_consistency(sqls, backend: str = "sqlglot") -> dict:
+    """
+    Compares the tables (case-insensitively) and columns extracted by backend
+    with the sql_metadata output over sqls, and returns the agreement counts,
+    the parsing time of each backend and a few mismatching queries.
+    """
+    report = {"queries": 0, "tables_agree": 0, "columns_agree": 0, "errors": 0, "mismatches": [],
+              "seconds": {"sql_metadata": 0.0, backend: 0.0}}
+
+    for sql in sqls:
+        report["queries"] += 1
+        try:
+            start = time.perf_counter()
+            expected = _parse_sql_metadata(normalize_sql(sql))
+            report["seconds"]["sql_metadata"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            actual = _parse.__wrapped__(normalize_sql(sql), backend)
+            report["seconds"][backend] += time.perf_counter() - start
+        except Exception as err:
+            report["errors"] += 1
+            print(f"[PARSE] Could not parse {sql}: {err}")
+            continue
+
+        tables_agree = {t.lower() for t in expected[0]} == {t.lower() for t in actual[0]}
+        columns_agree = {c.lower() for c in expected[1]} == {c.lower() for c in actual[1]}
+        report["tables_agree"] += tables_agree
+        report["columns_agree"] += columns_agree
+        if not tables_agree and len(report["mismatches"]) < 10:
+            report["mismatches"].append({"sql": sql, "sql_metadata": expected[0], backend: actual[0]})
+
+    return report
+
+
+def main():
+    from pipeline.jsonl import read_records
+
+    parser = argparse.ArgumentParser(description="Check a SQL parser backend against sql_metadata.")
+    parser.add_argument("--input_file", type=str, default="data/dev.json", help="Records with SQL to parse.")
+    parser.add_argument("--field", type=str, default="SQL", help="Record field holding the SQL.")
+    parser.add_argument("--backend", type=str, default="sqlglot", help="Backend to compare.")
+    args = parser.parse_args()
+
+    sqls = [record[args.field] for record in read_records(args.input_file) if record.get(args.field)]
+    report = check_consistency(sqls, args.backend)
+
+    print(f"[PARSE] {report['queries']} queries, {report['errors']} errors")
+    print(f"[PARSE] Tables agree on {report['tables_agree']}, columns on {report['columns_agree']}")
+    print(f"[PARSE] Parsing time: " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in report["seconds"].items()))
+    for mismatch in report["mismatches"]:
+        print(f"[PARSE] Mismatch: {mismatch}")
+
+
+if __name__ == "__main__":
+    main()
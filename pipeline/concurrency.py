@@ -0,0 +1,39 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def ordered_map(
+        fn: Callable[[T], R],
+        items: Iterable[T],
+        max_workers: int = 1,
+        max_in_flight: Optional[int] = None,
+) -> Iterator[R]:
+    """
+    Apply fn to every item using a thread pool and yield the results
+    in the same order as the input items.
+
+    At most max_in_flight items are submitted at any time (defaults to
+    2 * max_workers), so the input iterable is consumed lazily and
+    memory stays bounded. With max_workers <= 1 the items are processed
+    serially in the calling thread.
+    """
+    if max_workers <= 1:
+        for item in items:
+            yield fn(item)
+        return
+
+    max_in_flight = max(max_in_flight or 2 * max_workers, max_workers)
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
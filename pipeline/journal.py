@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import threading
+
+
+def file_digest(path: str) -> str:
+    """
+    Returns the SHA-256 of a file's content, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stage_signature(input_files: list, params: dict = None) -> str:
+    """
+    Returns a hash of the content of the input files and of the stage parameters.
+    """
+    digest = hashlib.sha256()
+    for path in input_files:
+        digest.update(path.encode("utf-8"))
+        digest.update(file_digest(path).encode("utf-8"))
+    digest.update(json.dumps(params or {}, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class Journal:
+    """
+    Append-only JSONL journal of completed work units, used to resume an
+    interrupted stage without redoing (and re-paying for) finished units.
+
+    The first line holds the signature of the stage inputs; a journal written
+    for different inputs is discarded when opened. Every following line holds
+    all the records of one unit, so a unit is either fully journaled or not at
+    all: a line truncated by a crash is ignored on load. Appends are flushed
+    and fsynced, and safe to call from several threads.
+    """
+
+    def __init__(self, path: str, signature: str):
+        self.path = path
+        self.signature = signature
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        """
+        Returns the journaled records as a dict of unit key -> list of records.
+        Starts a new journal if none exists or if it was written for other inputs.
+        """
+        units = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                header = f.readline()
+                try:
+                    valid = json.loads(header).get("signature") == self.signature
+                except json.JSONDecodeError:
+                    valid = False
+
+                if valid:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            # Partial line left by an interrupted write
+                            continue
+                        units[entry["key"]] = entry["records"]
+
+            if not valid:
+                print(f"[JOURNAL] {self.path} was written for different inputs, starting over")
+            elif units and not line.endswith("\n"):
+                # Terminate the partial line so the next append starts on a new one
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("\n")
+
+        if not units:
+            self._write_header()
+        return units
+
+    def _write_header(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"signature": self.signature}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append(self, key, records: list):
+        """
+        Durably appends the records of one completed unit.
+        """
+        line = json.dumps({"key": key, "records": records}, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def remove(self):
+        with self._lock:
+            remove_journal(self.path)
+
+
+def remove_journal(path: str):
+    """
+    Deletes the journal at path, if any: once its stage has completed (or is
+    forced to re-run) its units must not be replayed.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def stage_is_current(state_file: str, stage: str, signature: str, output_files: list) -> bool:
+    """
+    Returns True if stage already completed with the same input signature
+    and all its output files still exist.
+    """
+    if not os.path.exists(state_file) or not all(os.path.exists(path) for path in output_files):
+        return False
+    with open(state_file, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    return state.get(stage) == signature
+
+
+def mark_stage_done(state_file: str, stage: str, signature: str):
+    """
+    Records that stage completed for the given input signature.
+    """
+    state = {}
+    if os.path.exists(state_file):
+        with open(state_file, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    state[stage] = signature
+
+    if os.path.dirname(state_file):
+        os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_file, state_file)
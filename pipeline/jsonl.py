@@ -0,0 +1,100 @@
+import json
+import os
+from typing import Callable, Iterable, Iterator
+
+from pipeline.metrics import timed
+
+try:
+    import orjson
+except ImportError:  # optional faster encoder
+    orjson = None
+
+
+def is_jsonl(path: str) -> bool:
+    return path.endswith(".jsonl")
+
+
+@timed("jsonl.dumps_record")
+def dumps_record(record, default: Callable = None) -> str:
+    """
+    Serializes a record to a single JSON line (without the trailing newline),
+    using orjson when it is installed. Non-string dict keys are converted to
+    strings, as json does.
+    """
+    if orjson is not None:
+        return orjson.dumps(record, default=default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=default)
+
+
+def read_records(path: str) -> Iterator[dict]:
+    """
+    Yields the records of a JSONL file one at a time.
+
+    Legacy JSON files (an array of records, an array wrapped in an extra list,
+    or a single record object) are still accepted; those are loaded whole.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        first_char = f.read(4096).lstrip()[:1]
+        f.seek(0)
+
+        if first_char == "[":
+            data = json.load(f)
+            # Flatten if wrapped in an extra list
+            if len(data) == 1 and isinstance(data[0], list):
+                data = data[0]
+            yield from data
+            return
+
+        first_line = f.readline()
+        try:
+            first_record = json.loads(first_line) if first_line.strip() else None
+        except json.JSONDecodeError:
+            # A single, pretty-printed JSON object
+            f.seek(0)
+            yield json.load(f)
+            return
+
+        if first_record is not None:
+            yield first_record
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_records(path: str, records: Iterable[dict], default: Callable = None) -> int:
+    """
+    Writes records to path and returns how many were written.
+
+    A .jsonl path is written one record per line as the records are produced,
+    so the records are never held in memory all at once; any other path is
+    written as a legacy, indented JSON array.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if not is_jsonl(path):
+        records = list(records)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False, indent=2, default=default)
+        return len(records)
+
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(dumps_record(record, default) + "\n")
+            count += 1
+    return count
+
+
+def tee_records(path: str, records: Iterable[dict], default: Callable = None) -> Iterator[dict]:
+    """
+    Yields records unchanged while writing each of them to the .jsonl file at path,
+    so the output of a stage can be saved while the next stage consumes it.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(dumps_record(record, default) + "\n")
+            yield record
@@ -0,0 +1,253 @@
+import functools
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Percentiles reported for every timer
+PERCENTILES = (50, 95, 99)
+
+# Timers keep fixed log-spaced histogram buckets instead of raw samples, so memory does
+# not grow with the number of observations: HISTOGRAM_BUCKETS_PER_DECADE buckets per power
+# of ten from HISTOGRAM_MIN_S to HISTOGRAM_MAX_S, i.e. percentiles within ~6% of the exact value
+HISTOGRAM_MIN_S = 1e-6
+HISTOGRAM_MAX_S = 1e4
+HISTOGRAM_BUCKETS_PER_DECADE = 40
+HISTOGRAM_BUCKETS = math.ceil(math.log10(HISTOGRAM_MAX_S / HISTOGRAM_MIN_S) * HISTOGRAM_BUCKETS_PER_DECADE) + 1
+
+
+class Histogram:
+    """
+    Latency distribution of one timer: exact count, total and max, and bucketed
+    percentiles. Bucket i holds the durations up to HISTOGRAM_MIN_S * 10 ** (i / per decade);
+    longer durations fall in the last bucket.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if seconds <= HISTOGRAM_MIN_S:
+            index = 0
+        else:
+            index = math.ceil(math.log10(seconds / HISTOGRAM_MIN_S) * HISTOGRAM_BUCKETS_PER_DECADE)
+        self.buckets[min(index, HISTOGRAM_BUCKETS - 1)] += 1
+
+    def percentile(self, p: float) -> float:
+        """
+        Nearest-rank percentile, reported as the upper bound of its bucket (at most the max).
+        """
+        rank = max(1, math.ceil(p / 100 * self.count))
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(HISTOGRAM_MIN_S * 10 ** (index / HISTOGRAM_BUCKETS_PER_DECADE), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        summary = {
+            "count": self.count,
+            "total_s": round(self.total, 6),
+            "mean_s": round(self.total / self.count, 6),
+            "max_s": round(self.max, 6),
+        }
+        for p in PERCENTILES:
+            summary[f"p{p}_s"] = round(self.percentile(p), 6)
+        return summary
+
+
+# End of iteration marker of Metrics.timed_iter
+_DONE = object()
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(durations: list) -> dict:
+    values = sorted(durations)
+    summary = {
+        "count": len(values),
+        "total_s": round(sum(values), 6),
+        "mean_s": round(sum(values) / len(values), 6),
+        "max_s": round(values[-1], 6),
+    }
+    for p in PERCENTILES:
+        summary[f"p{p}_s"] = round(percentile(values, p), 6)
+    return summary
+
+
+class Metrics:
+    """
+    Thread-safe registry of timers and counters.
+
+    Every observation is recorded under its name and, when a label is given
+    (e.g. the db_id or model_id), also under that label, so the report shows
+    the overall latency distribution of each hot path and its breakdown.
+    Timers are kept as bounded histograms, so memory does not depend on the
+    number of observations.
+    """
+
+    def __init__(self):
+        self._timers = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        # Per-thread time spent in nested exclusive spans, see _exclusive_span
+        self._local = threading.local()
+
+    def observe(self, name: str, seconds: float, label: str = None):
+        with self._lock:
+            labels = self._timers.setdefault(name, {})
+            labels.setdefault(None, Histogram()).add(seconds)
+            if label is not None:
+                labels.setdefault(str(label), Histogram()).add(seconds)
+
+    def increment(self, name: str, value: float = 1, label: str = None):
+        with self._lock:
+            labels = self._counters.setdefault(name, {})
+            labels[None] = labels.get(None, 0) + value
+            if label is not None:
+                labels[str(label)] = labels.get(str(label), 0) + value
+
+    @contextmanager
+    def timer(self, name: str, label: str = None):
+        """
+        Times the enclosed block; failures are timed too and counted as <name>.errors.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.increment(f"{name}.errors", label=label)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, label)
+
+    @contextmanager
+    def _exclusive_span(self, spans: list):
+        """
+        Appends to spans the duration of the enclosed block minus the time spent in
+        exclusive spans nested inside it (in the same thread), e.g. the upstream
+        stages of a generator chain pulled from inside the block.
+        """
+        outer = getattr(self._local, "nested", 0.0)
+        self._local.nested = 0.0
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            spans.append(elapsed - self._local.nested)
+            self._local.nested = outer + elapsed
+
+    @contextmanager
+    def exclusive_timer(self, name: str, label: str = None):
+        """
+        Like timer, but excludes the time spent producing the items of the
+        timed_iter generators consumed inside the block.
+        """
+        spans = []
+        try:
+            with self._exclusive_span(spans):
+                yield
+        finally:
+            self.observe(name, spans[0], label)
+
+    def timed_iter(self, name: str, iterable, label: str = None):
+        """
+        Yields the items of iterable and records, once it is exhausted or closed, the
+        total time spent producing them under name. Time spent in upstream timed_iter
+        generators is excluded, so every stage of a generator chain gets its own time.
+        """
+        iterator = iter(iterable)
+        total = 0.0
+        try:
+            while True:
+                spans = []
+                with self._exclusive_span(spans):
+                    item = next(iterator, _DONE)
+                total += spans[0]
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            self.observe(name, total, label)
+
+    def timed(self, name: str, label=None):
+        """
+        Decorator timing every call of the function under name. label, if given,
+        is called with the same arguments as the function and returns the call's label.
+        """
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, label(*args, **kwargs) if label else None):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def report(self) -> dict:
+        """
+        Returns the latency summaries (count, total, mean, max, p50/p95/p99) and the
+        counters, each with an "all" entry and one entry per label.
+        """
+        with self._lock:
+            timers = {name: {label: histogram.summary() for label, histogram in labels.items()}
+                      for name, labels in self._timers.items()}
+            counters = {name: dict(labels) for name, labels in self._counters.items()}
+
+        return {
+            "timers": {
+                name: {
+                    "all": labels.pop(None),
+                    "by_label": dict(sorted(labels.items())),
+                }
+                for name, labels in sorted(timers.items())
+            },
+            "counters": {
+                name: {
+                    "all": labels.pop(None),
+                    "by_label": dict(sorted(labels.items())),
+                }
+                for name, labels in sorted(counters.items())
+            },
+        }
+
+    def write_report(self, path: str, extra: dict = None):
+        """
+        Writes report() to path as JSON, merged with any extra sections.
+        """
+        content = self.report()
+        content.update(extra or {})
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(content, f, indent=2, default=str)
+
+    def reset(self):
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+
+
+# Process-wide registry used by the instrumented functions
+METRICS = Metrics()
+
+timer = METRICS.timer
+timed = METRICS.timed
+increment = METRICS.increment
+exclusive_timer = METRICS.exclusive_timer
+timed_iter = METRICS.timed_iter
@@ -1,7 +1,18 @@
 #!/usr/bin/env python3
-from llm.run_llm_exp import run_llm_process
-from llm.clean_output import clean_llm_output
-from evaluation.run_evaluation import evaluate_llm_outputs
+import os
+
+from llm.run_llm_exp import stream_llm_process
+from llm.clean_output import clean_records
+from evaluation.run_evaluation import evaluate_records
+from llm.adapters import token_usage_stats
+from llm.cache import CompletionCache
+from llm.llm_request import set_completion_cache
+from llm.rate_limit import rate_limiter_stats
+from llm.schema import create_schema_provider, set_schema_provider
+from pgdb.pg_utils import close_pool
+from pipeline.journal import stage_signature, stage_is_current, mark_stage_done, remove_journal
+from pipeline.jsonl import read_records, tee_records
+from pipeline.metrics import METRICS, exclusive_timer, timed_iter
 
 
 def main():
@@ -9,22 +20,98 @@ def main():
     # Parameters
     input_file = "data/dev_enriched.json"
 
-    raw_output_file = f"results/{input_file.split('/')[-1].replace('.json', '_raw.json')}"
-    cleaned_output_file = f"results/{input_file.split('/')[-1].replace('.json', '_cleaned.json')}"
-    output_log_path = f"results/{input_file.split('/')[-1].replace('.json', '_log.json')}"
+    # Every stage streams its records to the next one, and saves them as JSONL
+    name = os.path.splitext(os.path.basename(input_file))[0]
+    raw_output_file = f"results/{name}_raw.jsonl"
+    cleaned_output_file = f"results/{name}_cleaned.jsonl"
+    output_log_path = f"results/{name}_log.jsonl"
+    journal_file = f"results/{name}_journal.jsonl"
+    gold_cache_path = "results/gold_cache.sqlite"
+    # Latency percentiles, counters, token usage and retries of the run
+    metrics_report_path = f"results/{name}_metrics.json"
+
+    # Completed stages and the signature of their inputs, used to skip unchanged stages
+    state_file = "results/pipeline_state.json"
+    # Re-run every stage even if its inputs did not change
+    force = False
 
     # AWS bedrock model_id
     model_id = "anthropic.claude-3-5-sonnet-20240620-v1:0"
 
-    print("[RUN] Calling LLM...")
-    run_llm_process(input_file=input_file, output_file=raw_output_file, model_id=model_id)
+    # Number of questions sent to the LLM (and items evaluated) concurrently
+    max_workers = 8
+
+    # Prompt schemas from the live database ("postgres") or from data/dev_tables.json ("tables_json")
+    schema_source = "postgres"
+    set_schema_provider(create_schema_provider(schema_source))
+
+    # Keep only the mapped tables and their foreign key neighbours up to this many hops
+    # in the prompt (None sends the whole schema)
+    schema_pruning_radius = None
+
+    # Persistent cache of LLM completions, so re-runs with identical prompts are free
+    cache = CompletionCache("results/llm_cache.sqlite")
+    set_completion_cache(cache)
+
+    llm_signature = stage_signature([input_file], {
+        "model_id": model_id,
+        "schema_source": schema_source,
+        "schema_pruning_radius": schema_pruning_radius,
+    })
+    llm_current = not force and stage_is_current(state_file, "llm", llm_signature, [raw_output_file])
+    clean_current = llm_current and stage_is_current(
+        state_file, "clean", stage_signature([raw_output_file]), [cleaned_output_file])
+    evaluation_current = clean_current and stage_is_current(
+        state_file, "evaluation", stage_signature([cleaned_output_file]), [output_log_path])
+
+    if evaluation_current:
+        print("[RUN] Evaluation is up to date, skipping.")
+    else:
+        # The stages are chained as generators: every record flows from the LLM through
+        # cleaning to evaluation as soon as it is produced, and each stage output is
+        # saved on the way. Up to date stages are read back from their output instead.
+        if llm_current:
+            print("[RUN] LLM output is up to date, reading it.")
+            raw_records = read_records(raw_output_file)
+        else:
+            print("[RUN] Calling LLM...")
+            if force:
+                # A forced run must call the model again instead of replaying the journal
+                remove_journal(journal_file)
+            raw_records = timed_iter("stage", tee_records(raw_output_file, stream_llm_process(
+                input_file=input_file, model_id=model_id, max_workers=max_workers,
+                journal_file=journal_file, schema_pruning_radius=schema_pruning_radius,
+            )), label="llm")
+
+        if clean_current:
+            print("[RUN] Cleaned LLM output is up to date, reading it.")
+            cleaned_records = read_records(cleaned_output_file)
+        else:
+            cleaned_records = timed_iter("stage", tee_records(cleaned_output_file, clean_records(raw_records)),
+                                         label="clean")
+
+        print("[RUN] Evaluating LLM output...")
+        # Each stage is timed without the upstream stages it pulls records from
+        with exclusive_timer("stage", label="evaluation"):
+            evaluate_records(cleaned_records, output_log_path=output_log_path,
+                             max_workers=max_workers, gold_cache_path=gold_cache_path)
 
-    print("[RUN] Cleaning LLM output...")
-    clean_llm_output(input_file=raw_output_file, output_file=cleaned_output_file, model_id=model_id)
+        if not llm_current:
+            mark_stage_done(state_file, "llm", llm_signature)
+            # The raw output now holds every question, the journal is only needed for interrupted runs
+            remove_journal(journal_file)
+            print(f"[RUN] LLM cache stats: {cache.stats()}")
+        mark_stage_done(state_file, "clean", stage_signature([raw_output_file]))
+        mark_stage_done(state_file, "evaluation", stage_signature([cleaned_output_file]))
 
-    print("[RUN] Evaluating LLM output...")
-    evaluate_llm_outputs(json_path=cleaned_output_file, output_log_path=output_log_path)
+    close_pool()
 
+    METRICS.write_report(metrics_report_path, extra={
+        "token_usage": token_usage_stats(),
+        "rate_limiter": rate_limiter_stats(),
+        "llm_cache": cache.stats(),
+    })
+    print(f"[RUN] Metrics report saved to {metrics_report_path}")
     print("[RUN] All done!")
 
 
@@ -1,79 +1,224 @@
-import json
-import spacy
-from nltk.tokenize import word_tokenize
-from pathlib import Path
+import argparse
 import logging
-from sql_metadata import Parser
-from sklearn.feature_extraction.text import TfidfVectorizer
+import os
+import pickle
+import threading
+from pathlib import Path
+
 import numpy as np
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from pgdb.sql_parse import extract_tables, extract_columns
+from pipeline.jsonl import read_records, write_records
+
+# Repository data directory, independent of the working directory
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
 
-# Load spaCy model
-logging.info("Loading spaCy model...")
-nlp = spacy.load("en_core_web_sm")
+SPACY_MODEL = "en_core_web_sm"
+# spaCy batching: questions are annotated SPACY_BATCH_SIZE at a time by SPACY_N_PROCESS processes
+SPACY_BATCH_SIZE = int(os.getenv("SPACY_BATCH_SIZE", "256"))
+SPACY_N_PROCESS = int(os.getenv("SPACY_N_PROCESS", "1"))
+# Log progress every LOG_EVERY questions
+LOG_EVERY = int(os.getenv("LOG_EVERY", "100"))
 
-# --- Load Data ---
-data_path = Path("data/train.json")
-schema_path = Path("data/train_tables.json")
 
-with open(data_path) as f:
-    dataset = json.load(f)
+def top_tfidf_tokens(tfidf_matrix, feature_names, k=10, min_score=0.0):
+    """
+    Returns, for every row of a sparse TF-IDF matrix, a dict of its (at most) k
+    highest scoring terms whose score is above min_score, in descending score order.
 
-with open(schema_path) as f:
-    table_list = json.load(f)
+    Works on the CSR nonzeros of all rows at once: entries are sorted by
+    (row, -score) with a single lexsort and cut at rank k within each row,
+    so no dense row of vocabulary size is ever built.
 
-# Convert schema list to dict by db_id
-table_data = {table["db_id"]: table for table in table_list}
+    Ties are broken by descending term index, i.e. the order of a stable
+    row.argsort(kind="stable")[::-1][:k]. The original row.argsort()[::-1][:k]
+    used numpy's default unstable sort, whose tie order is arbitrary.
+    """
+    matrix = tfidf_matrix.tocsr()
+    n_rows = matrix.shape[0]
 
-# --- Compute TF-IDF for All Questions ---
-logging.info("Computing TF-IDF scores for all questions...")
-questions = [item["question"] for item in dataset]
-vectorizer = TfidfVectorizer(stop_words="english", lowercase=True)
-tfidf_matrix = vectorizer.fit_transform(questions)
-feature_names = np.array(vectorizer.get_feature_names_out())
+    rows = np.repeat(np.arange(n_rows), np.diff(matrix.indptr))
+    keep = matrix.data > min_score
+    rows, cols, scores = rows[keep], matrix.indices[keep], matrix.data[keep]
 
-# --- Enrich Dataset ---
-enriched = []
-logging.info("Enriching dataset with token tagging and SQL metadata parsing...")
+    # Sort by row, then by descending score, then by descending term index
+    order = np.lexsort((-cols, -scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
 
-for idx, item in enumerate(dataset):
-    question = item["question"]
-    db_id = item["db_id"]
-    sql = item.get("SQL", "")
+    # Rank of every entry within its row, keep the first k
+    row_starts = np.searchsorted(rows, np.arange(n_rows))
+    top = np.arange(len(rows)) - row_starts[rows] < k
+    rows, cols, scores = rows[top], cols[top], scores[top]
 
-    # spaCy doc for full token info
-    doc = nlp(question)
-    tokens_info = [(token.text, token.lemma_, token.pos_, token.ent_type_) for token in doc]
+    bounds = np.searchsorted(rows, np.arange(n_rows + 1))
+    return [
+        {feature_names[c]: float(score) for c, score in zip(cols[start:end], scores[start:end])}
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
 
-    # Extract TF-IDF terms and scores for this question
-    row = tfidf_matrix[idx].toarray().flatten()
-    top_indices = row.argsort()[::-1][:10]  # Top 10 tokens
-    informative_tokens = {feature_names[i]: float(row[i]) for i in top_indices if row[i] > 0}
 
-    # Extract table and column names using sql-metadata
+def extract_sql_metadata(sql: str):
+    """
+    Returns the tables and columns referenced by sql, or empty lists if it cannot be parsed.
+    """
     try:
-        parser = Parser(sql)
-        sql_tables = parser.tables
-        sql_columns = parser.columns
+        return extract_tables(sql), extract_columns(sql)
     except Exception:
-        sql_tables = []
-        sql_columns = []
-
-    enriched.append({
-        **item,
-        "tokens": tokens_info,
-        "informative_tokens": informative_tokens,
-        "sql_tables": sql_tables,
-        "sql_columns": sql_columns,
-    })
-
-    if idx % 100 == 0:
-        logging.info(f"Processed {idx}/{len(dataset)} questions...")
-
-# --- Save Enriched File ---
-logging.info("Saving enriched dataset to file...")
-with open("data/train_enriched.json", "w") as f:
-    json.dump(enriched, f, indent=2)
-
-logging.info("Done! Enriched dataset saved as enriched_dataset.json")
\ No newline at end of file
+        return [], []
+
+
+class Enricher:
+    """
+    Enriches questions with spaCy token annotations, their most informative
+    TF-IDF terms and the tables/columns used by their SQL.
+
+    The spaCy model and the TF-IDF vectorizer are loaded lazily, once, so importing
+    this module is cheap. fit() learns the TF-IDF vocabulary from an iterable of
+    questions; transform() then enriches any iterable of items with it, in batches,
+    and can be called repeatedly (e.g. for new questions at run time). The fitted
+    vectorizer can be saved and loaded instead of being refitted.
+    """
+
+    def __init__(self, top_k: int = 10, min_score: float = 0.0, spacy_model: str = SPACY_MODEL,
+                 batch_size: int = SPACY_BATCH_SIZE, n_process: int = SPACY_N_PROCESS, log_every: int = LOG_EVERY):
+        self.top_k = top_k
+        self.min_score = min_score
+        self.spacy_model = spacy_model
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.log_every = log_every
+        self.vectorizer = None
+        self.feature_names = None
+        self._nlp = None
+        self._lock = threading.Lock()
+
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            with self._lock:
+                if self._nlp is None:
+                    import spacy
+
+                    # Only token text, lemma, POS and entity type are used, so the dependency parser is disabled
+                    logging.info("Loading spaCy model...")
+                    self._nlp = spacy.load(self.spacy_model, disable=["parser"])
+        return self._nlp
+
+    def fit(self, questions):
+        """
+        Fits the TF-IDF vectorizer on an iterable of question strings.
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        logging.info("Computing TF-IDF scores for all questions...")
+        self.vectorizer = TfidfVectorizer(stop_words="english", lowercase=True)
+        self.vectorizer.fit(questions)
+        self.feature_names = np.array(self.vectorizer.get_feature_names_out())
+        return self
+
+    def transform(self, items):
+        """
+        Yields a copy of every item (a dict with "question" and optionally "SQL")
+        with "tokens", "informative_tokens", "sql_tables" and "sql_columns" added.
+        Items are consumed lazily and annotated batch_size at a time.
+        """
+        if self.vectorizer is None:
+            raise ValueError("Enricher is not fitted, call fit() or load() first.")
+
+        docs = self.nlp.pipe(
+            ((item["question"], item) for item in items),
+            as_tuples=True,
+            batch_size=self.batch_size,
+            n_process=self.n_process,
+        )
+
+        batch = []
+        processed = 0
+        for doc, item in docs:
+            batch.append((doc, item))
+            if len(batch) >= self.batch_size:
+                yield from self._enrich_batch(batch, processed)
+                processed += len(batch)
+                batch = []
+        if batch:
+            yield from self._enrich_batch(batch, processed)
+
+    def _enrich_batch(self, batch, processed):
+        # TF-IDF terms and scores of the whole batch, in one pass over the sparse matrix
+        tfidf_matrix = self.vectorizer.transform([item["question"] for _, item in batch])
+        informative_tokens_list = top_tfidf_tokens(tfidf_matrix, self.feature_names, self.top_k, self.min_score)
+
+        for offset, ((doc, item), informative_tokens) in enumerate(zip(batch, informative_tokens_list)):
+            tokens_info = [(token.text, token.lemma_, token.pos_, token.ent_type_) for token in doc]
+
+            # Extract table and column names using sql-metadata
+            sql_tables, sql_columns = extract_sql_metadata(item.get("SQL", ""))
+
+            if (processed + offset) % self.log_every == 0:
+                logging.info(f"Processed {processed + offset} questions...")
+
+            yield {
+                **item,
+                "tokens": tokens_info,
+                "informative_tokens": informative_tokens,
+                "sql_tables": sql_tables,
+                "sql_columns": sql_columns,
+            }
+
+    def fit_transform(self, items):
+        items = list(items)
+        self.fit(item["question"] for item in items)
+        return self.transform(items)
+
+    def save(self, path):
+        """
+        Saves the fitted vectorizer and settings to path.
+        """
+        with open(path, "wb") as f:
+            pickle.dump({"vectorizer": self.vectorizer, "top_k": self.top_k, "min_score": self.min_score}, f)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        Returns an Enricher using the vectorizer saved at path.
+        """
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        enricher = cls(top_k=state["top_k"], min_score=state["min_score"], **kwargs)
+        enricher.vectorizer = state["vectorizer"]
+        enricher.feature_names = np.array(enricher.vectorizer.get_feature_names_out())
+        return enricher
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enrich questions with token tagging, TF-IDF terms and SQL metadata.")
+    parser.add_argument("--input_file", type=str, default=str(DATA_DIR / "train.json"),
+                        help="Path to the questions (JSON array or JSONL).")
+    parser.add_argument("--output_file", type=str, default=str(DATA_DIR / "train_enriched.json"),
+                        help="Path to save the enriched questions.")
+    parser.add_argument("--vectorizer", type=str, default=None,
+                        help="Fitted vectorizer to reuse; if missing it is fitted on the input and saved there.")
+    parser.add_argument("--batch_size", type=int, default=SPACY_BATCH_SIZE, help="spaCy batch size.")
+    parser.add_argument("--n_process", type=int, default=SPACY_N_PROCESS, help="Number of spaCy processes.")
+    parser.add_argument("--log_every", type=int, default=LOG_EVERY, help="Progress log interval.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    settings = {"batch_size": args.batch_size, "n_process": args.n_process, "log_every": args.log_every}
+
+    if args.vectorizer and os.path.exists(args.vectorizer):
+        enricher = Enricher.load(args.vectorizer, **settings)
+        enriched = enricher.transform(read_records(args.input_file))
+    else:
+        enricher = Enricher(**settings)
+        enriched = enricher.fit_transform(read_records(args.input_file))
+        if args.vectorizer:
+            enricher.save(args.vectorizer)
+
+    logging.info("Enriching dataset with token tagging and SQL metadata parsing...")
+    write_records(args.output_file, enriched)
+    logging.info(f"Done! Enriched dataset saved as {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
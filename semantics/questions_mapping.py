@@ -1,29 +1,19 @@
+import argparse
 import json
-import spacy
 import logging
+import threading
 from pathlib import Path
-from rapidfuzz import fuzz  # pip install rapidfuzz
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+import numpy as np
+from rapidfuzz import fuzz, process  # pip install rapidfuzz
 
-# We'll assume you already have an enriched dataset with informative_tokens
-# Example: 'informative_tokens': { 'popularity': 0.2725, '1945': 0.3655, ... }
+from pipeline.jsonl import read_records, write_records
 
-# 1. Load the existing enriched dataset & schema
-logging.info("Loading enriched dataset...")
-data_path = Path("../data/train_enriched.json")  # your enriched dataset
-schema_path = Path("../data/train_tables.json")  # your schema
+# Repository data directory, independent of the working directory
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
 
-with open(data_path) as f:
-    dataset = json.load(f)
 
-logging.info("Loading table schema...")
-with open(schema_path) as f:
-    table_list = json.load(f)
-
-table_data = {table["db_id"]: table for table in table_list}
-
-# 2. Preprocessing function for column names
+# Preprocessing function for column names
 
 def preprocess_column_name(col_name: str):
     """
@@ -33,7 +23,7 @@ def preprocess_column_name(col_name: str):
     return col_name.lower().replace(",", "").replace(".", "").replace("-", "_").split("_")
 
 
-# 3. Fuzzy matching function
+# Fuzzy matching function
 
 def best_column_for_token(token: str, possible_columns: list, threshold=60):
     """Return the best matching column (and score) for a single token, or None if below threshold."""
@@ -53,47 +43,155 @@ def best_column_for_token(token: str, possible_columns: list, threshold=60):
         return best_col, best_score
     return None, best_score
 
-# 4. Enrich dataset with token→column mappings (for informative tokens only)
-enriched_mappings = []
-logging.info("Matching only informative tokens to columns...")
-
-for idx, item in enumerate(dataset):
-    db_id = item.get("db_id")
-    if not db_id or db_id not in table_data:
-        # No schema info
-        enriched_mappings.append(item)
-        continue
-
-    # Get columns for this DB
-    raw_cols = table_data[db_id]["column_names"]
-    columns = [col[1] for col in raw_cols if col[1]]
-
-    # We'll only match the keys from informative_tokens
-    # Example: 'informative_tokens': { 'popularity': 0.27, 'year': 0.25, ... }
-    info_tokens = item.get("informative_tokens", {})  # dict
-
-    token_column_map = []
-    for tok in info_tokens.keys():
-        best_col, score = best_column_for_token(tok, columns, threshold=60)
-        if best_col:
-            token_column_map.append({
-                "token": tok,
-                "column": best_col,
-                "score": score
-            })
-
-    # Store results
-    new_item = dict(item)
-    new_item["info_token_column_map"] = token_column_map
-    enriched_mappings.append(new_item)
-
-    if idx % 100 == 0:
-        logging.info(f"Processed {idx}/{len(dataset)} items...")
-
-# 5. Save output
-out_path = Path("../data/train_enriched_mapping.json")
-logging.info(f"Saving final results to {out_path}")
-with out_path.open("w") as f:
-    json.dump(enriched_mappings, f, indent=2)
-
-logging.info("Done! The dataset now has 'info_token_column_map' for each question.")
+
+class ColumnIndex:
+    """
+    Precomputed fuzzy matching index over the columns of one database.
+
+    Column subwords are split once and deduplicated; each subword remembers the
+    first column containing it. Tokens are then scored against all subwords in
+    bulk with process.cdist, giving the same result as best_column_for_token:
+    the first column (in schema order) holding a best scoring subword.
+    """
+
+    def __init__(self, columns: list):
+        self.columns = columns
+        subword_column = {}
+        for col_idx, col in enumerate(columns):
+            for sub in preprocess_column_name(col):
+                subword_column.setdefault(sub, col_idx)
+        self.subwords = list(subword_column)
+        self.subword_columns = np.array(list(subword_column.values()), dtype=np.int64)
+
+    def best_columns(self, tokens: list, threshold=60, workers: int = 1) -> list:
+        """
+        Returns a (column, score) pair for every token, with column None when
+        no subword scores at least threshold.
+        """
+        tokens_lower = [token.lower() for token in tokens]
+        if not tokens_lower or not self.subwords:
+            return [(None, 0) for _ in tokens_lower]
+
+        scores = process.cdist(tokens_lower, self.subwords, scorer=fuzz.partial_ratio,
+                               score_cutoff=threshold, workers=workers)
+        best_scores = scores.max(axis=1)
+
+        matches = []
+        for token_lower, row, best in zip(tokens_lower, scores, best_scores):
+            if best <= 0 or best < threshold:
+                matches.append((None, 0))
+                continue
+            candidates = np.flatnonzero(row == best)
+            winner = candidates[np.argmin(self.subword_columns[candidates])]
+            # Re-score the winning subword for the exact (non float32) score
+            score = fuzz.partial_ratio(token_lower, self.subwords[winner])
+            matches.append((self.columns[self.subword_columns[winner]], score))
+        return matches
+
+
+class ColumnMapper:
+    """
+    Maps the informative tokens of enriched questions to the best matching
+    column of their database, adding an "info_token_column_map" to each item.
+
+    The schema index (tables JSON by db_id) is loaded lazily, once, and a
+    ColumnIndex is built once per database. workers > 1 (or -1 for all cores)
+    spreads the fuzzy matching over several threads.
+    """
+
+    def __init__(self, tables_path=DATA_DIR / "train_tables.json", threshold: int = 60, log_every: int = 100,
+                 workers: int = 1):
+        self.tables_path = Path(tables_path)
+        self.threshold = threshold
+        self.log_every = log_every
+        self.workers = workers
+        self._table_data = None
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def table_data(self) -> dict:
+        if self._table_data is None:
+            with self._lock:
+                if self._table_data is None:
+                    logging.info("Loading table schema...")
+                    with open(self.tables_path) as f:
+                        table_list = json.load(f)
+                    self._table_data = {table["db_id"]: table for table in table_list}
+        return self._table_data
+
+    def columns(self, db_id: str) -> list:
+        raw_cols = self.table_data[db_id]["column_names"]
+        return [col[1] for col in raw_cols if col[1]]
+
+    def column_index(self, db_id: str) -> ColumnIndex:
+        index = self._indexes.get(db_id)
+        if index is None:
+            index = ColumnIndex(self.columns(db_id))
+            self._indexes[db_id] = index
+        return index
+
+    def map_tokens(self, db_id: str, tokens) -> list:
+        """
+        Returns the token -> column matches of tokens above the threshold.
+        """
+        tokens = list(tokens)
+        matches = self.column_index(db_id).best_columns(tokens, threshold=self.threshold, workers=self.workers)
+        token_column_map = []
+        for tok, (best_col, score) in zip(tokens, matches):
+            if best_col:
+                token_column_map.append({
+                    "token": tok,
+                    "column": best_col,
+                    "score": score
+                })
+        return token_column_map
+
+    def transform(self, items):
+        """
+        Yields every item with an "info_token_column_map" built from the keys of its
+        "informative_tokens"; items without schema information are yielded unchanged.
+        """
+        for idx, item in enumerate(items):
+            db_id = item.get("db_id")
+            if not db_id or db_id not in self.table_data:
+                # No schema info
+                yield item
+                continue
+
+            # We'll only match the keys from informative_tokens
+            # Example: 'informative_tokens': { 'popularity': 0.27, 'year': 0.25, ... }
+            info_tokens = item.get("informative_tokens", {})  # dict
+
+            new_item = dict(item)
+            new_item["info_token_column_map"] = self.map_tokens(db_id, info_tokens.keys())
+
+            if idx % self.log_every == 0:
+                logging.info(f"Processed {idx} items...")
+
+            yield new_item
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Match the informative tokens of enriched questions to columns.")
+    parser.add_argument("--input_file", type=str, default=str(DATA_DIR / "train_enriched.json"),
+                        help="Path to the enriched dataset (JSON array or JSONL).")
+    parser.add_argument("--tables_file", type=str, default=str(DATA_DIR / "train_tables.json"),
+                        help="Path to the tables schema JSON.")
+    parser.add_argument("--output_file", type=str, default=str(DATA_DIR / "train_enriched_mapping.json"),
+                        help="Path to save the mapped dataset.")
+    parser.add_argument("--threshold", type=int, default=60, help="Minimum fuzzy matching score.")
+    parser.add_argument("--workers", type=int, default=1, help="Matching threads (-1 for all cores).")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    mapper = ColumnMapper(args.tables_file, threshold=args.threshold, workers=args.workers)
+    logging.info("Matching only informative tokens to columns...")
+    write_records(args.output_file, mapper.transform(read_records(args.input_file)))
+
+    logging.info(f"Done! Saved {args.output_file} with 'info_token_column_map' for each question.")
+
+
+if __name__ == "__main__":
+    main()
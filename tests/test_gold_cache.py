@@ -0,0 +1,26 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import evaluation.gold_cache as gold_cache
+from evaluation.gold_cache import GoldResultCache
+
+
+def test_fingerprint_is_computed_once_per_db_id(monkeypatch, tmp_path):
+    calls = []
+    lock = threading.Lock()
+
+    def slow_fingerprint(cursor, db_id):
+        with lock:
+            calls.append(db_id)
+        time.sleep(0.05)
+        return f"{db_id}-fingerprint"
+
+    monkeypatch.setattr(gold_cache, "database_fingerprint", slow_fingerprint)
+    cache = GoldResultCache(str(tmp_path / "gold.sqlite"))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        fingerprints = list(pool.map(lambda _: cache._fingerprint("formula_1", None), range(8)))
+
+    assert fingerprints == ["formula_1-fingerprint"] * 8
+    assert calls == ["formula_1"]
@@ -0,0 +1,40 @@
+import time
+
+from pipeline.metrics import HISTOGRAM_BUCKETS, Metrics
+
+
+def slow(items, seconds):
+    for item in items:
+        time.sleep(seconds)
+        yield item
+
+
+def test_chained_stages_are_timed_exclusively():
+    metrics = Metrics()
+    source = metrics.timed_iter("stage", slow(range(5), 0.01), label="llm")
+    cleaned = metrics.timed_iter("stage", slow(source, 0.02), label="clean")
+    with metrics.exclusive_timer("stage", label="evaluation"):
+        for _ in cleaned:
+            time.sleep(0.03)
+
+    stages = metrics.report()["timers"]["stage"]["by_label"]
+    assert abs(stages["llm"]["total_s"] - 0.05) < 0.02
+    assert abs(stages["clean"]["total_s"] - 0.10) < 0.02
+    assert abs(stages["evaluation"]["total_s"] - 0.15) < 0.02
+
+
+def test_timer_percentiles_come_from_bounded_histograms():
+    metrics = Metrics()
+    durations = [i / 1000 for i in range(1, 1001)]
+    for seconds in durations:
+        metrics.observe("query", seconds, label="db")
+
+    summary = metrics.report()["timers"]["query"]["by_label"]["db"]
+    assert summary["count"] == 1000
+    assert summary["max_s"] == 1.0
+    assert abs(summary["total_s"] - sum(durations)) < 1e-6
+    for p, exact in ((50, 0.5), (95, 0.95), (99, 0.99)):
+        assert exact <= summary[f"p{p}_s"] <= exact * 1.06
+
+    histogram = metrics._timers["query"]["db"]
+    assert len(histogram.buckets) == HISTOGRAM_BUCKETS
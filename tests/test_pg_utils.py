@@ -0,0 +1,58 @@
+from pgdb.pg_utils import database_fingerprint
+
+
+class StubCursor:
+    """
+    Cursor returning the queued results in order, one per execute() call.
+    """
+
+    def __init__(self, results):
+        self.results = list(results)
+        self.queries = []
+        self._current = None
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+        self._current = self.results.pop(0)
+
+    def fetchone(self):
+        return self._current[0] if self._current else None
+
+    def fetchall(self):
+        return self._current
+
+
+def test_database_fingerprint_combines_catalog_and_row_checksums():
+    cursor = StubCursor([
+        [("Patient", '"Patient"'), ("Examination", '"Examination"'), ("Laboratory", None)],
+        [("Patient", 10, 123), ("Examination", 5, -7)],
+        [("catalog-md5",)],
+    ])
+    fingerprint = database_fingerprint(cursor, "thrombosis_prediction", data_version="v1", row_checksum=True)
+
+    assert fingerprint.startswith("catalog-md5-v1-")
+    assert len(fingerprint.rsplit("-", 1)[1]) == 32
+    # The missing Laboratory table is not scanned
+    assert "Laboratory" not in cursor.queries[1]
+
+    # Row checksums do not depend on the order the tables are returned in
+    reordered = StubCursor([
+        [("Examination", '"Examination"'), ("Patient", '"Patient"'), ("Laboratory", None)],
+        [("Examination", 5, -7), ("Patient", 10, 123)],
+        [("catalog-md5",)],
+    ])
+    assert database_fingerprint(reordered, "thrombosis_prediction", data_version="v1", row_checksum=True) == fingerprint
+
+    changed = StubCursor([
+        [("Patient", '"Patient"'), ("Examination", '"Examination"'), ("Laboratory", None)],
+        [("Patient", 10, 124), ("Examination", 5, -7)],
+        [("catalog-md5",)],
+    ])
+    assert database_fingerprint(changed, "thrombosis_prediction", data_version="v1", row_checksum=True) != fingerprint
+
+
+def test_database_fingerprint_defaults_to_catalog_and_data_version():
+    cursor = StubCursor([[("catalog-md5",)]])
+    assert database_fingerprint(cursor, "thrombosis_prediction", data_version="v1") == "catalog-md5-v1"
+    # Only the catalog query runs, no table is scanned
+    assert len(cursor.queries) == 1